@@ -0,0 +1,74 @@
+from datetime import datetime
+from enum import Enum
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from modactions import ModAction
+
+if TYPE_CHECKING:
+    from message import Message
+
+
+class AutomodState(Enum):
+    queued = "queued"  # Hold message is waiting in the delivery queue
+    sending = "sending"  # Hold message is currently being posted
+    delivered = "delivered"  # Hold message has been posted and can be edited
+
+
+class AutomodEntry:
+    __slots__ = ("hold", "state", "resolution", "messages")
+
+    def __init__(self, hold: "Message"):
+        self.hold: Message = hold
+        self.state: AutomodState = AutomodState.queued
+        self.resolution: Optional[Message] = None
+        self.messages: list = []  # Webhook messages posted for the hold, used for edits
+
+
+class AutomodTracker:
+    # Tracks every held automod message by message_id so the hold and its resolution
+    # end up as a single post (merged if the hold hasn't gone out yet, edited if it has)
+    def __init__(self):
+        self._entries: Dict[str, AutomodEntry] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, message_id: str) -> Optional[AutomodEntry]:
+        return self._entries.get(message_id, None)
+
+    def pop(self, message_id: str) -> Optional[AutomodEntry]:
+        return self._entries.pop(message_id, None)
+
+    def track(self, message: "Message") -> bool:
+        # Returns True if the message was absorbed by a pending hold and must not be delivered on its own.
+        # Runs on the event loop with no awaits, so checking and updating state can't interleave
+        if message.mod_action == ModAction.automod_caught_message:
+            self._entries[message.automod_message_id] = AutomodEntry(message)
+            return False
+        if message.mod_action in (ModAction.automod_allowed_message, ModAction.automod_denied_message):
+            entry = self._entries.get(message.automod_message_id, None)
+            if entry is None or entry.state == AutomodState.delivered:
+                return False  # Unknown hold or already posted, the resolution is delivered normally and edits
+            # Hold is still queued or mid-send, whoever sends the hold will post or edit to the final state
+            entry.resolution = message
+            return True
+        return False
+
+    def absorbed(self, message: "Message") -> Optional["Message"]:
+        # The resolution merged into this hold, if any. It never went on the queue, so saving the queue has to include it
+        if message.mod_action != ModAction.automod_caught_message:
+            return None
+        entry = self._entries.get(message.automod_message_id, None)
+        if entry is None or entry.hold is not message:
+            return None
+        return entry.resolution
+
+    def cleanup(self, max_age: int, pending_max_age: int = 3600) -> int:
+        # Drop delivered holds that never got a resolution. Pending holds are left for the sender unless they're
+        # older than pending_max_age, by then the hold was lost on its way out and nobody will finish it
+        now = datetime.utcnow().timestamp()
+        stale: List[str] = [message_id for message_id, entry in self._entries.items()
+                            if entry.hold.created_at.timestamp() < now - (max_age if entry.state == AutomodState.delivered else pending_max_age)]
+        for message_id in stale:
+            del self._entries[message_id]
+        return len(stale)
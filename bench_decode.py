@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Compares the old decode path (bytes -> str -> loads -> nested dict lookups) with events.decode_frame,
+# which decodes with msgspec. The old path runs on the standard library json, and on orjson too if it's installed
+# Usage: python3 bench_decode.py [iterations]
+
+import json
+import sys
+from timeit import repeat
+
+from events import decode_frame
+
+BACKENDS = [json.loads]
+try:
+    import orjson
+    BACKENDS.append(orjson.loads)
+except ImportError:
+    pass
+
+BAN_FRAME = json.dumps({
+    "metadata": {
+        "message_id": "befa7b53-d79d-478f-86b9-120f112b044e",
+        "message_type": "notification",
+        "message_timestamp": "2024-11-20T18:40:12.634234626Z",
+        "subscription_type": "channel.moderate",
+        "subscription_version": "2"
+    },
+    "payload": {
+        "subscription": {
+            "id": "f1c2a387-161a-49f9-a165-0f21d7a4e1c4",
+            "status": "enabled",
+            "type": "channel.moderate",
+            "version": "2",
+            "condition": {"broadcaster_user_id": "1337", "moderator_user_id": "9001"},
+            "transport": {"method": "websocket", "session_id": "AQoQexAWVYKSTIu4ec_2VAxyuhAB"},
+            "created_at": "2024-11-20T18:00:00.000000000Z",
+            "cost": 0
+        },
+        "event": {
+            "broadcaster_user_id": "1337",
+            "broadcaster_user_login": "cool_user",
+            "broadcaster_user_name": "Cool_User",
+            "source_broadcaster_user_id": None,
+            "source_broadcaster_user_login": None,
+            "source_broadcaster_user_name": None,
+            "moderator_user_id": "9001",
+            "moderator_user_login": "cool_mod",
+            "moderator_user_name": "Cool_Mod",
+            "action": "ban",
+            "followers": None, "slow": None, "vip": None, "unvip": None, "mod": None, "unmod": None,
+            "ban": {"user_id": "4242", "user_login": "bad_user", "user_name": "Bad_User", "reason": "spam"},
+            "unban": None, "timeout": None, "untimeout": None, "raid": None, "unraid": None, "delete": None,
+            "automod_terms": None, "unban_request": None, "warn": None,
+            "shared_chat_ban": None, "shared_chat_unban": None, "shared_chat_timeout": None,
+            "shared_chat_untimeout": None, "shared_chat_delete": None
+        }
+    }
+}).encode()
+
+AUTOMOD_FRAME = json.dumps({
+    "metadata": {
+        "message_id": "2d1a1e0b-9ab3-4e57-8a1c-2b7b8e6a1f00",
+        "message_type": "notification",
+        "message_timestamp": "2024-11-20T18:40:12.634234626Z",
+        "subscription_type": "automod.message.hold",
+        "subscription_version": "2"
+    },
+    "payload": {
+        "subscription": {
+            "id": "e0d1b7a4-5e2c-4c59-9a3f-6f5c3b1d2e10",
+            "status": "enabled",
+            "type": "automod.message.hold",
+            "version": "2",
+            "condition": {"broadcaster_user_id": "1337", "moderator_user_id": "9001"},
+            "transport": {"method": "websocket", "session_id": "AQoQexAWVYKSTIu4ec_2VAxyuhAB"},
+            "created_at": "2024-11-20T18:00:00.000000000Z",
+            "cost": 0
+        },
+        "event": {
+            "broadcaster_user_id": "1337",
+            "broadcaster_user_login": "cool_user",
+            "broadcaster_user_name": "Cool_User",
+            "user_id": "4242",
+            "user_login": "bad_user",
+            "user_name": "Bad_User",
+            "message_id": "bad-message-id",
+            "message": {
+                "text": "this is a bad message",
+                "fragments": [{"type": "text", "text": "this is a bad message", "cheermote": None, "emote": None}]
+            },
+            "reason": "blocked_term",
+            "automod": None,
+            "blocked_term": {
+                "terms_found": [{
+                    "term_id": "123",
+                    "owner_broadcaster_user_id": "1337",
+                    "owner_broadcaster_user_login": "cool_user",
+                    "owner_broadcaster_user_name": "Cool_User",
+                    "boundary": {"start_pos": 10, "end_pos": 12}
+                }]
+            },
+            "held_at": "2024-11-20T18:40:12.634234626Z"
+        }
+    }
+}).encode()
+
+
+loads = json.loads  # For the old path
+
+
+def old_ban(buffer: bytes):
+    data = loads(str(buffer.decode("utf-8")))
+    metadata = data["metadata"]
+    subscription = data["payload"]["subscription"]
+    event = data["payload"]["event"]
+    return (metadata["message_type"], metadata["message_timestamp"], subscription["type"], event["broadcaster_user_id"],
+            event["action"], event["moderator_user_name"], event["ban"]["user_login"], event["ban"]["reason"])
+
+
+def new_ban(buffer: bytes):
+    frame = decode_frame(buffer)
+    event = frame.event
+    return (frame.metadata.message_type, frame.metadata.message_timestamp, frame.subscription.type, event.broadcaster_user_id,
+            event.action, event.moderator_user_name, event.target.user_login, event.target.reason)
+
+
+def old_automod(buffer: bytes):
+    data = loads(str(buffer.decode("utf-8")))
+    subscription = data["payload"]["subscription"]
+    event = data["payload"]["event"]
+    terms = [event["message"]["text"][t["boundary"]["start_pos"]:t["boundary"]["end_pos"]+1] for t in event["blocked_term"]["terms_found"]]
+    fragments = [f.get("text", None) for f in event["message"]["fragments"] if f != {} and f.get("text", None) is not None]
+    return subscription["type"], event["broadcaster_user_id"], event["user_login"], event["message_id"], terms, fragments
+
+
+def new_automod(buffer: bytes):
+    frame = decode_frame(buffer)
+    event = frame.event
+    terms = [event.message.text[t.boundary.start_pos:t.boundary.end_pos+1] for t in event.blocked_term.terms_found]
+    fragments = [f.text for f in event.message.fragments if f.text is not None]
+    return frame.subscription.type, event.broadcaster_user_id, event.user_login, event.message_id, terms, fragments
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f"Best of 5x{iterations} iterations")
+    for loads in BACKENDS:
+        for name, old, new, frame in (("channel.moderate ban", old_ban, new_ban, BAN_FRAME), ("automod.message.hold", old_automod, new_automod, AUTOMOD_FRAME)):
+            assert old(frame) == new(frame)
+            old_time = min(repeat(lambda: old(frame), number=iterations, repeat=5))
+            new_time = min(repeat(lambda: new(frame), number=iterations, repeat=5))
+            print(f"old on {loads.__module__:<7} {name:<22} old {old_time/iterations*1e6:7.2f}us  new {new_time/iterations*1e6:7.2f}us  ({old_time/new_time:.2f}x)")
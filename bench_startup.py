@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# Measures how long a fresh interpreter takes to import main and build the parser, in text and embed mode,
+# and checks text mode never pulls in the modules it's meant to skip. Exits with 1 if it does, or if it's over the budget
+# Usage: python3 bench_startup.py [runs] [max_text_mode_ms]
+
+import json
+import os
+import subprocess
+import sys
+
+# Only loaded when something actually needs them. Text mode over the websocket transport shouldn't need any
+DEFERRED = ["disnake", "humanize", "requests", "websockets", "aiohttp.web"]
+
+CHILD = """
+import asyncio, json, sys
+from time import perf_counter
+start = perf_counter()
+import main
+from messageparser import Parser
+async def build():
+    Parser({{}}, use_embeds={use_embeds})
+asyncio.run(build())
+print(json.dumps({{"ms": (perf_counter() - start) * 1000, "loaded": [m for m in {deferred!r} if m in sys.modules]}}))
+"""
+
+
+def measure(use_embeds: bool, runs: int) -> tuple[float, list]:
+    best, loaded = float("inf"), []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", CHILD.format(use_embeds=use_embeds, deferred=DEFERRED)], capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        best = min(best, result["ms"])
+        loaded = result["loaded"]
+    return best, loaded
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    budget = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    failed = False
+    for name, use_embeds in (("text mode", False), ("embed mode", True)):
+        ms, loaded = measure(use_embeds, runs)
+        print(f"{name:<11} {ms:7.1f}ms  loaded: {', '.join(loaded) or 'none of the deferred modules'}")
+        if not use_embeds:
+            if loaded:
+                print(f"Text mode imported {', '.join(loaded)} at startup!")
+                failed = True
+            if budget is not None and ms > budget:
+                print(f"Text mode startup took {ms:.1f}ms, over the {budget:.0f}ms budget!")
+                failed = True
+    sys.exit(1 if failed else 0)
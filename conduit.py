@@ -0,0 +1,69 @@
+import logging
+from typing import Callable, Optional
+
+from aiohttp import ClientSession
+
+API_URL = "https://api.twitch.tv/helix"
+
+
+class ConduitError(Exception):
+    pass
+
+
+class Conduit:
+    # A Twitch conduit lets several websocket sessions (shards) share one set of subscriptions.
+    # Subscriptions are created once against the conduit, and a reconnecting session only needs its shard re-pointed
+    def __init__(self, session: ClientSession, headers: Callable[[], dict], shard_count: int = 1, conduit_id: Optional[str] = None):
+        self.logging = logging.getLogger("Twitch Pubsub Logging")
+        self.session = session
+        self.headers = headers  # Called for every request so a refreshed app token is picked up
+        self.shard_count = shard_count
+        self.id: Optional[str] = conduit_id
+
+    async def ensure(self) -> str:
+        # Use the configured conduit, otherwise create one. Other conduits of this client may belong to another
+        # deployment sharing the client id, so they're never adopted
+        if self.id is None:
+            r = await self.session.post(f"{API_URL}/eventsub/conduits", headers=self.headers(), json={"shard_count": self.shard_count})
+            r.raise_for_status()
+            self.id = (await r.json())["data"][0]["id"]
+            self.logging.info(f"Created conduit {self.id} with {self.shard_count} shard{'' if self.shard_count == 1 else 's'}, "
+                              f"set it as the conduit id in settings.json to keep its subscriptions across restarts")
+            return self.id
+
+        r = await self.session.get(f"{API_URL}/eventsub/conduits", headers=self.headers())
+        r.raise_for_status()
+        existing = next((c for c in (await r.json())["data"] if c["id"] == self.id), None)
+        if existing is None:
+            raise ConduitError(f"Conduit {self.id} does not exist")
+        if existing["shard_count"] < self.shard_count:
+            r = await self.session.patch(f"{API_URL}/eventsub/conduits", headers=self.headers(), json={"id": self.id, "shard_count": self.shard_count})
+            r.raise_for_status()
+            self.logging.info(f"Resized conduit {self.id} to {self.shard_count} shards")
+        else:
+            self.logging.info(f"Using existing conduit {self.id}")
+        return self.id
+
+    async def assign_shard(self, shard_id: int, session_id: str):
+        # Point a shard at a websocket session. One request no matter how many subscriptions the conduit holds
+        r = await self.session.patch(f"{API_URL}/eventsub/conduits/shards", headers=self.headers(), json={
+            "conduit_id": self.id,
+            "shards": [{
+                "id": str(shard_id),
+                "transport": {
+                    "method": "websocket",
+                    "session_id": session_id
+                }
+            }]
+        })
+        r.raise_for_status()
+        errors = (await r.json()).get("errors", [])
+        if errors:
+            raise ConduitError(f"Unable to assign shard {shard_id}: {errors[0].get('message', errors[0])}")
+        self.logging.info(f"Assigned conduit shard {shard_id} to session {session_id}")
+
+    def transport(self) -> dict:
+        return {
+            "method": "conduit",
+            "conduit_id": self.id
+        }
@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from time import monotonic
+from traceback import extract_tb, format_tb
+from typing import Awaitable, Callable, Dict, Optional, Union
+
+REPORT_CHECK_INTERVAL = 5
+
+
+def error_signature(e: Exception) -> str:
+    # Same exception type raised from the same line is the same problem, whatever the message or the event said
+    tb = extract_tb(e.__traceback__)
+    where = f"{tb[-1].filename}:{tb[-1].lineno}:{tb[-1].name}" if tb else ""
+    return hashlib.sha1(f"{type(e).__name__}@{where}".encode()).hexdigest()[:12]
+
+
+def format_exception(e: Exception) -> str:
+    return "Traceback (most recent call last):\n" + ''.join(format_tb(e.__traceback__)) + f"{type(e).__name__}: {e}"
+
+
+class ErrorGroup:
+    __slots__ = ("signature", "error", "traceback", "sample", "count")
+
+    def __init__(self, signature: str, error: str, traceback: str, sample: Optional[dict]):
+        self.signature = signature
+        self.error = error
+        self.traceback = traceback
+        self.sample = sample  # Event of the first frame that failed this way
+        self.count = 0
+
+
+class DeadLetterQueue:
+    # Frames that failed to process are appended to `path` as JSON lines with their traceback, off the receive path,
+    # so `python3 main.py reprocess` can replay them once the cause is fixed. Failures are also grouped by signature
+    # per streamer and handed to send_report at most once every report_interval seconds for each streamer
+    def __init__(self, path: str = "deadletter.jsonl", report_interval: float = 300):
+        self.logging = logging.getLogger("Twitch Pubsub Logging")
+        self.path = path
+        self.report_interval = report_interval
+        self._writes: asyncio.Queue = asyncio.Queue()
+        self._groups: Dict[Optional[str], Dict[str, ErrorGroup]] = {}  # streamer id -> signature -> failures since the last report
+        self._last_report: Dict[Optional[str], float] = {}
+
+    def add(self, e: Exception, frame: Optional[dict], raw_message: Union[str, bytes, dict, None], streamer_id: Optional[str] = None) -> ErrorGroup:
+        # Never awaits, so it's safe to call straight from the receive path
+        signature = error_signature(e)
+        traceback = format_exception(e)
+        groups = self._groups.setdefault(streamer_id, {})
+        group = groups.get(signature, None)
+        if group is None:
+            group = groups[signature] = ErrorGroup(signature, f"{type(e).__name__}: {e}", traceback,
+                                                   (frame or {}).get("payload", {}).get("event", None))
+            self.logging.error(group.traceback)  # Full traceback once per report, a line for the rest
+        else:
+            self.logging.error(f"{type(e).__name__}: {e} (seen {group.count + 1} times, signature {signature})")
+        group.count += 1
+
+        # Only notifications can be replayed, and undecodable messages might decode after a fix
+        if frame is not None and frame.get("metadata", {}).get("message_type", None) != "notification":
+            return group
+        if frame is None and isinstance(raw_message, bytes):
+            raw_message = raw_message.decode(errors="replace")
+        self._writes.put_nowait({
+            "failed_at": datetime.now(timezone.utc).isoformat(),
+            "signature": signature,
+            "error": group.error,
+            "traceback": traceback,
+            "frame": frame,
+            "raw": raw_message if frame is None else None
+        })
+        return group
+
+    def _append(self, records: list):
+        with open(self.path, "a") as f:
+            f.writelines(json.dumps(record) + "\n" for record in records)
+
+    async def writer(self):
+        while True:
+            records = [await self._writes.get()]
+            while not self._writes.empty():
+                records.append(self._writes.get_nowait())
+            try:
+                await asyncio.to_thread(self._append, records)
+            except OSError as e:
+                self.logging.error(f"Unable to write {len(records)} dead letter{'' if len(records) == 1 else 's'} to {self.path}: {e}")
+            for _ in records:
+                self._writes.task_done()
+
+    async def flush(self):
+        await self._writes.join()
+
+    def close(self):
+        # Write out anything the writer didn't get to, once the loop is done with it
+        records = []
+        while not self._writes.empty():
+            records.append(self._writes.get_nowait())
+        if records:
+            try:
+                self._append(records)
+            except OSError as e:
+                self.logging.error(f"Unable to write {len(records)} dead letter{'' if len(records) == 1 else 's'} to {self.path}: {e}")
+
+    async def reporter(self, send_report: Callable[[str, list[ErrorGroup]], Awaitable[None]]):
+        while True:
+            await asyncio.sleep(REPORT_CHECK_INTERVAL)
+            now = monotonic()
+            for streamer_id in list(self._groups.keys()):
+                if now - self._last_report.get(streamer_id, -self.report_interval) < self.report_interval:
+                    continue
+                groups = list(self._groups.pop(streamer_id).values())
+                if streamer_id is None:
+                    continue  # Nowhere to send those, they were logged when they happened
+                self._last_report[streamer_id] = now
+                try:
+                    await send_report(streamer_id, groups)
+                except Exception as e:
+                    self.logging.error(f"Unable to send error report: {type(e).__name__}: {e}")
+
+    def take(self) -> list[dict]:
+        # Moves the queue aside and returns its entries, so anything failing again while reprocessing starts a fresh file.
+        # If an earlier reprocess didn't finish, its entries are taken again first
+        taken = f"{self.path}.reprocessing"
+        if not os.path.exists(taken):
+            try:
+                os.replace(self.path, taken)
+            except FileNotFoundError:
+                return []
+        records = []
+        with open(taken) as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    self.logging.warning(f"Skipping unreadable dead letter on line {line_no} of {taken}")
+        return records
+
+    def done(self):
+        try:
+            os.remove(f"{self.path}.reprocessing")
+        except FileNotFoundError:
+            pass
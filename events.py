@@ -0,0 +1,358 @@
+from time import perf_counter
+from typing import Mapping, Optional, Union
+
+import msgspec
+from msgspec import Raw, Struct, field
+
+# Untyped, for Frame.raw and for error reports
+_loads = msgspec.json.Decoder().decode
+
+
+class SchemaError(ValueError):
+    def __init__(self, path: str, reason: str, raw: Optional[dict] = None):
+        super().__init__(f"{path}: {reason}")
+        self.path = path
+        self.reason = reason
+        self.raw = raw  # The decoded frame if the JSON itself was valid, so error handling doesn't need to parse it again
+
+
+def _join(path: str, key: str) -> str:
+    return f"{path}.{key}" if path and key else path or key
+
+
+def _schema_error(e: msgspec.DecodeError, path: str) -> SchemaError:
+    # msgspec reports "Expected `str`, got `int` - at `$.event.user_id`", relative to whatever it was decoding
+    if not isinstance(e, msgspec.ValidationError):
+        return SchemaError("$", f"invalid JSON ({e})")
+    reason, _, at = str(e).partition(" - at `$")
+    return SchemaError(_join(path, at.rstrip("`").lstrip(".")) or "$", reason)
+
+
+# Envelope
+# Structs are slotted and built by msgspec's compiled decoders. None can be part of a reference cycle, so gc=False
+# keeps the garbage collector from tracking them
+
+class Metadata(Struct, gc=False):
+    message_id: str
+    message_type: str
+    message_timestamp: str
+    subscription_type: Optional[str] = None
+    subscription_version: Optional[str] = None
+
+
+class Session(Struct, gc=False):
+    id: str
+    status: str
+    reconnect_url: Optional[str] = None
+
+
+class Subscription(Struct, gc=False):
+    id: str
+    type: str
+    version: str
+    status: str
+    condition: dict
+
+
+class Payload(Struct, gc=False):
+    session: Optional[Session] = None
+    subscription: Optional[Subscription] = None
+    event: Raw = Raw()  # Left undecoded until the subscription says what it is
+
+
+class Envelope(Struct, gc=False):
+    metadata: Metadata
+    payload: Payload
+
+
+# channel.moderate v2 action payloads
+
+class UserAction(Struct, gc=False):
+    user_id: str
+    user_login: str
+    user_name: str
+
+
+class BanAction(UserAction):
+    reason: Optional[str] = None
+
+
+class TimeoutAction(UserAction, kw_only=True):
+    reason: Optional[str] = None
+    expires_at: str
+
+
+class DeleteAction(UserAction):
+    message_id: str
+    message_body: str
+
+
+class WarnAction(UserAction):
+    reason: Optional[str] = None
+    chat_rules_cited: Optional[list[str]] = None
+
+
+class UnbanRequestAction(UserAction):
+    is_approved: bool
+    moderator_message: Optional[str] = None
+
+
+class RaidAction(UserAction):
+    viewer_count: int
+
+
+class SlowAction(Struct, gc=False):
+    wait_time_seconds: int
+
+
+class FollowersAction(Struct, gc=False):
+    follow_duration_minutes: int
+
+
+class AutomodTermsAction(Struct, gc=False):
+    action: str
+    list_type: str = field(name="list")  # blocked or permitted
+    terms: list[str] = []
+    from_automod: bool = False
+
+
+ModerateTarget = Union[UserAction, SlowAction, FollowersAction, AutomodTermsAction]
+
+# Action name -> event key holding its payload. Actions without a payload (slowoff, clear, ...) aren't listed
+MODERATE_ACTIONS: dict[str, str] = {
+    "ban": "ban",
+    "unban": "unban",
+    "timeout": "timeout",
+    "untimeout": "untimeout",
+    "delete": "delete",
+    "mod": "mod",
+    "unmod": "unmod",
+    "vip": "vip",
+    "unvip": "unvip",
+    "warn": "warn",
+    "acknowledge_warning": "acknowledge_warning",
+    "raid": "raid",
+    "unraid": "unraid",
+    "slow": "slow",
+    "followers": "followers",
+    "approve_unban_request": "unban_request",
+    "deny_unban_request": "unban_request",
+    "add_permitted_term": "automod_terms",
+    "add_blocked_term": "automod_terms",
+    "remove_permitted_term": "automod_terms",
+    "remove_blocked_term": "automod_terms",
+    "shared_chat_ban": "shared_chat_ban",
+    "shared_chat_unban": "shared_chat_unban",
+    "shared_chat_timeout": "shared_chat_timeout",
+    "shared_chat_untimeout": "shared_chat_untimeout",
+    "shared_chat_delete": "shared_chat_delete"
+}
+
+
+class ModerateEvent(Struct, kw_only=True, gc=False):
+    broadcaster_user_id: str
+    broadcaster_user_login: str
+    broadcaster_user_name: str
+    source_broadcaster_user_id: Optional[str] = None
+    moderator_user_id: str
+    moderator_user_login: str
+    moderator_user_name: str
+    action: str
+    # Twitch sends a key for every action, null except for the one that happened
+    ban: Optional[BanAction] = None
+    unban: Optional[UserAction] = None
+    timeout: Optional[TimeoutAction] = None
+    untimeout: Optional[UserAction] = None
+    delete: Optional[DeleteAction] = None
+    mod: Optional[UserAction] = None
+    unmod: Optional[UserAction] = None
+    vip: Optional[UserAction] = None
+    unvip: Optional[UserAction] = None
+    warn: Optional[WarnAction] = None
+    acknowledge_warning: Optional[UserAction] = None
+    raid: Optional[RaidAction] = None
+    unraid: Optional[UserAction] = None
+    slow: Optional[SlowAction] = None
+    followers: Optional[FollowersAction] = None
+    unban_request: Optional[UnbanRequestAction] = None
+    automod_terms: Optional[AutomodTermsAction] = None
+    shared_chat_ban: Optional[BanAction] = None
+    shared_chat_unban: Optional[UserAction] = None
+    shared_chat_timeout: Optional[TimeoutAction] = None
+    shared_chat_untimeout: Optional[UserAction] = None
+    shared_chat_delete: Optional[DeleteAction] = None
+
+    @property
+    def target(self) -> Optional[ModerateTarget]:
+        # The payload for this action, see MODERATE_ACTIONS
+        key = MODERATE_ACTIONS.get(self.action, None)
+        return getattr(self, key) if key is not None else None
+
+
+# automod.message.hold / automod.message.update v2
+
+class Boundary(Struct, gc=False):
+    start_pos: int
+    end_pos: int
+
+
+class Fragment(Struct, gc=False):
+    type: Optional[str] = None
+    text: Optional[str] = None
+
+
+class ChatMessage(Struct, gc=False):
+    text: str
+    fragments: list[Fragment]
+
+
+class AutomodClassification(Struct, gc=False):
+    category: str
+    level: int
+    boundaries: Optional[list[Boundary]] = None
+
+
+class BlockedTermFound(Struct, gc=False):
+    term_id: str
+    boundary: Boundary
+
+
+class BlockedTerm(Struct, gc=False):
+    terms_found: list[BlockedTermFound]
+
+
+class AutomodEvent(Struct, kw_only=True, gc=False):
+    broadcaster_user_id: str
+    broadcaster_user_login: str
+    broadcaster_user_name: str
+    user_id: str
+    user_login: str
+    user_name: str
+    message_id: str
+    message: ChatMessage
+    reason: str
+    automod: Optional[AutomodClassification] = None
+    blocked_term: Optional[BlockedTerm] = None
+    status: Optional[str] = None  # Only set on automod.message.update
+    moderator_user_name: Optional[str] = None  # Only set on automod.message.update
+
+
+Event = Union[ModerateEvent, AutomodEvent]
+
+# (subscription type, version) -> event struct
+EVENT_TYPES: dict[tuple[str, str], type] = {
+    ("channel.moderate", "2"): ModerateEvent,
+    ("automod.message.hold", "2"): AutomodEvent,
+    ("automod.message.update", "2"): AutomodEvent
+}
+
+# msgspec builds a compiled decoder per type, so they're made once
+_envelope_decoder = msgspec.json.Decoder(Envelope)
+_payload_decoder = msgspec.json.Decoder(Payload)
+_event_decoders = {key: msgspec.json.Decoder(event) for key, event in EVENT_TYPES.items()}
+
+
+class Frame:
+    # The typed view of a frame. raw, the frame as plain JSON objects, is only parsed if something asks for it,
+    # which is the dead-letter queue, the handoff state and sinks other than Discord
+    __slots__ = ("metadata", "session", "subscription", "event", "decode_span", "_source", "_metadata_raw", "_raw")
+
+    def __init__(self, metadata: Metadata, payload: Payload, source: Union[str, bytes, bytearray], metadata_raw: Optional[dict] = None):
+        self.metadata = metadata
+        self.session: Optional[Session] = payload.session
+        self.subscription: Optional[Subscription] = payload.subscription
+        self.event: Optional[Event] = None
+        self.decode_span: tuple[float, float] = (0, 0)  # perf_counter() start and end, for the profiler
+        self._source = source
+        self._metadata_raw = metadata_raw  # Webhooks send the payload only, with the metadata as headers
+        self._raw: Optional[dict] = None
+
+    @property
+    def raw(self) -> dict:
+        if self._raw is None:
+            if self._metadata_raw is None:
+                self._raw = _loads(self._source)
+            else:
+                self._raw = {"metadata": self._metadata_raw, "payload": _loads(self._source)}
+        return self._raw
+
+
+def _decode_event(frame: Frame, payload: Payload, path: str = "payload"):
+    if frame.metadata.message_type != "notification":
+        return
+    subscription = frame.subscription
+    if subscription is None:
+        raise SchemaError(_join(path, "subscription"), "missing")
+    decoder = _event_decoders.get((subscription.type, subscription.version), None)
+    if decoder is None:
+        raise SchemaError(_join(path, "subscription"), f"unsupported subscription {subscription.type} v{subscription.version}")
+    path = _join(path, "event")
+    if not payload.event:
+        raise SchemaError(path, "missing")
+    try:
+        event = decoder.decode(payload.event)
+    except msgspec.DecodeError as e:
+        raise _schema_error(e, path) from None
+    if event.__class__ is ModerateEvent and event.action in MODERATE_ACTIONS and event.target is None:
+        raise SchemaError(_join(path, MODERATE_ACTIONS[event.action]), f"expected object for {event.action} action, got null")
+    frame.event = event
+
+
+def decode_frame(buffer: Union[str, bytes, bytearray]) -> Frame:
+    # Decode a websocket frame straight from the received buffer, in one pass, into typed structs
+    start = perf_counter()
+    try:
+        envelope = _envelope_decoder.decode(buffer)
+    except msgspec.DecodeError as e:
+        error = _schema_error(e, "")
+        if isinstance(e, msgspec.ValidationError):
+            error.raw = _raw_or_none(buffer)
+        raise error from None
+    frame = Frame(envelope.metadata, envelope.payload, buffer)
+    try:
+        _decode_event(frame, envelope.payload)
+    except SchemaError as e:
+        e.raw = frame.raw
+        raise
+    frame.decode_span = (start, perf_counter())
+    return frame
+
+
+def decode_webhook(headers: Mapping[str, str], body: bytes) -> Frame:
+    # Webhook bodies carry the payload only, the metadata comes in as headers.
+    # raw is rebuilt in the same shape as websocket frames so everything downstream can treat them alike
+    start = perf_counter()
+    metadata_raw = {
+        "message_id": headers.get("Twitch-Eventsub-Message-Id", None),
+        "message_type": headers.get("Twitch-Eventsub-Message-Type", None),
+        "message_timestamp": headers.get("Twitch-Eventsub-Message-Timestamp", None),
+        "subscription_type": headers.get("Twitch-Eventsub-Subscription-Type", None),
+        "subscription_version": headers.get("Twitch-Eventsub-Subscription-Version", None)
+    }
+    try:
+        metadata = msgspec.convert(metadata_raw, Metadata)
+    except msgspec.ValidationError as e:
+        raise _schema_error(e, "headers") from None
+    try:
+        payload = _payload_decoder.decode(body)
+    except msgspec.DecodeError as e:
+        error = _schema_error(e, "")
+        if isinstance(e, msgspec.ValidationError):
+            error.raw = {"metadata": metadata_raw, "payload": _raw_or_none(body)}
+        raise error from None
+    frame = Frame(metadata, payload, body, metadata_raw)
+    try:
+        _decode_event(frame, payload, path="")
+    except SchemaError as e:
+        e.raw = frame.raw
+        raise
+    frame.decode_span = (start, perf_counter())
+    return frame
+
+
+def _raw_or_none(buffer) -> Optional[dict]:
+    try:
+        raw = _loads(buffer)
+    except msgspec.DecodeError:
+        return None
+    return raw if raw.__class__ is dict else None
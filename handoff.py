@@ -0,0 +1,106 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import signal
+from collections import Counter
+from contextlib import suppress
+from time import monotonic, time
+from typing import Iterable, Optional
+
+from events import Frame
+
+
+def frame_key(frame: Frame) -> str:
+    # Two instances subscribed to the same channel get the same event with different message ids,
+    # so overlapping instances have to compare what happened rather than how it was delivered
+    event = json.dumps(frame.raw["payload"].get("event", None), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(f"{frame.subscription.type}:{event}".encode()).hexdigest()
+
+
+class Handoff:
+    # Coordinates a restart. The running instance keeps its pid in pid_file. On shutdown it writes state_file
+    # with the frames it never delivered, and keys for everything it handled recently. A new instance that finds
+    # a live predecessor subscribes first, buffers what arrives, asks the old one to stop, then replays the
+    # predecessor's leftovers plus whatever only it received
+    def __init__(self, pid_file: str = "modlogging.pid", state_file: str = "pending.json"):
+        self.logging = logging.getLogger("Twitch Pubsub Logging")
+        self.pid_file = pid_file
+        self.state_file = state_file
+
+    def predecessor(self) -> Optional[int]:
+        if os.name != "posix":
+            return None # No signals to coordinate with
+        try:
+            with open(self.pid_file) as f:
+                pid = int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+        if pid == os.getpid():
+            return None
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return None
+        except PermissionError:
+            pass # Alive, just not ours to check. Sending it a signal will fail the same way later
+        try:
+            # Pids get reused, make sure we aren't about to stop some other program
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                if b"main.py" not in f.read():
+                    return None
+        except FileNotFoundError:
+            pass # No procfs, trust the pid file
+        return pid
+
+    def claim(self):
+        with open(self.pid_file, "w") as f:
+            f.write(str(os.getpid()))
+
+    def release(self):
+        try:
+            with open(self.pid_file) as f:
+                if f.read().strip() != str(os.getpid()):
+                    return # A successor already took over
+            os.remove(self.pid_file)
+        except (FileNotFoundError, ValueError):
+            pass
+
+    async def stop_predecessor(self, pid: int, timeout: float) -> bool:
+        try:
+            os.kill(pid, signal.SIGTERM) # The predecessor drains and saves its state before exiting
+        except (ProcessLookupError, PermissionError) as e:
+            self.logging.warning(f"Unable to signal previous instance {pid}: {e}")
+            return False
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                return True
+            await asyncio.sleep(0.1)
+        self.logging.warning(f"Previous instance {pid} still running after {timeout:.0f} seconds")
+        return False
+
+    def save_state(self, seen: Iterable[str], pending: list[dict]):
+        # seen has a key per event handled, repeated when identical events arrived more than once
+        tmp = f"{self.state_file}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"written_at": time(), "seen": list(seen), "pending": pending}, f)
+        os.replace(tmp, self.state_file) # Never leave a half written file for the next instance
+
+    def load_state(self) -> tuple[Counter, list[dict]]:
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return Counter(), []
+        except ValueError:
+            self.logging.error(f"Ignoring unreadable state file {self.state_file}")
+            return Counter(), []
+        finally:
+            with suppress(FileNotFoundError):
+                os.remove(self.state_file)
+        return Counter(state.get("seen", [])), state.get("pending", [])
+
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional
+
+from aiohttp import ClientSession
+
+# Just enough of a Discord webhook client for text mode, so starting up doesn't have to import disnake.
+# Mirrors the parts of disnake's API that the parser and messages use, so either can be handed to them
+
+MAX_ATTEMPTS = 5
+
+
+class HTTPException(Exception):
+    def __init__(self, status: int, text: str):
+        self.status = status
+        self.text = text
+        super().__init__(f"{status}: {text}")
+
+
+class NotFound(HTTPException):
+    pass
+
+
+class AllowedMentions:
+    def __init__(self, parse: Optional[list] = None):
+        self.parse = parse or []
+
+    @classmethod
+    def none(cls):
+        return cls()
+
+    def to_dict(self) -> dict:
+        return {"parse": self.parse}
+
+
+class Embed:
+    def __init__(self, title: Optional[str] = None, description: Optional[str] = None, color: Optional[int] = None, timestamp: Optional[datetime] = None):
+        self.title = title
+        self.description = description
+        self.color = color
+        self.timestamp = timestamp
+        self.fields: list[dict] = []
+        self.footer: Optional[dict] = None
+
+    @property
+    def colour(self):
+        return self.color
+
+    @colour.setter
+    def colour(self, value: int):
+        self.color = value
+
+    def add_field(self, name: str, value: str, inline: bool = True):
+        self.fields.append({"name": str(name), "value": str(value), "inline": inline})
+        return self
+
+    def remove_field(self, index: int):
+        try:
+            del self.fields[index]
+        except IndexError:
+            pass
+
+    def set_footer(self, text: Optional[str] = None, icon_url: Optional[str] = None):
+        self.footer = {k: v for k, v in (("text", text), ("icon_url", icon_url)) if v is not None}
+        return self
+
+    def to_dict(self) -> dict:
+        d = {"type": "rich"}
+        if self.title is not None:
+            d["title"] = self.title
+        if self.description is not None:
+            d["description"] = self.description
+        if self.color is not None:
+            d["color"] = self.color
+        if self.timestamp is not None:
+            d["timestamp"] = self.timestamp.isoformat()
+        if self.fields:
+            d["fields"] = self.fields
+        if self.footer:
+            d["footer"] = self.footer
+        return d
+
+
+class Webhook:
+    def __init__(self, url: str, session: ClientSession):
+        self.logging = logging.getLogger("Twitch Pubsub Logging")
+        self.url = url.split("?", 1)[0].rstrip("/")
+        self.session = session
+
+    @classmethod
+    def from_url(cls, url: str, session: ClientSession):
+        return cls(url, session)
+
+    async def request(self, method: str, url: str, payload: dict, params: Optional[dict] = None) -> Optional[dict]:
+        for attempt in range(MAX_ATTEMPTS):
+            async with self.session.request(method, url, json=payload, params=params) as r:
+                if r.status == 429:  # Discord says how long to back off for, in seconds
+                    try:
+                        retry_after = float((await r.json()).get("retry_after", 1))
+                    except Exception:
+                        retry_after = float(r.headers.get("Retry-After", 1))
+                    self.logging.debug(f"Webhook rate limited, retrying in {retry_after}s")
+                    await asyncio.sleep(retry_after)
+                    continue
+                if r.status >= 500 and attempt + 1 < MAX_ATTEMPTS:
+                    await asyncio.sleep(1 + attempt * 2)
+                    continue
+                if r.status == 404:
+                    raise NotFound(r.status, await r.text())
+                if r.status >= 400:
+                    raise HTTPException(r.status, await r.text())
+                if r.status == 204:
+                    return None
+                return await r.json()
+        raise HTTPException(429, "Still rate limited after retrying")
+
+    def payload(self, content: Optional[str], embed: Optional[Embed], allowed_mentions: Optional[AllowedMentions]) -> dict:
+        payload = {}
+        if content is not None:
+            payload["content"] = content
+        if embed is not None:
+            payload["embeds"] = [embed.to_dict()]
+        if allowed_mentions is not None:
+            payload["allowed_mentions"] = allowed_mentions.to_dict()
+        return payload
+
+    async def send(self, content: Optional[str] = None, *, embed: Optional[Embed] = None, allowed_mentions: Optional[AllowedMentions] = None, wait: bool = False):
+        data = await self.request("POST", self.url, self.payload(content, embed, allowed_mentions), params={"wait": "true"} if wait else None)
+        if wait and data is not None:
+            return WebhookMessage(self, data["id"])
+
+
+class WebhookMessage:
+    def __init__(self, webhook: Webhook, id: str):
+        self.webhook = webhook
+        self.id = id
+
+    async def edit(self, content: Optional[str] = None, *, embed: Optional[Embed] = None, allowed_mentions: Optional[AllowedMentions] = None):
+        await self.webhook.request("PATCH", f"{self.webhook.url}/messages/{self.id}", self.webhook.payload(content, embed, allowed_mentions))
@@ -0,0 +1,89 @@
+import json
+import logging
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from time import monotonic
+
+TEXT_FORMAT = "%(levelname)s [%(module)s %(funcName)s %(lineno)d]: %(message)s"
+# Extra attributes that per-event log lines carry, included as top level fields in JSON output
+EVENT_FIELDS = ("streamer", "action", "moderator", "latency", "suppressed")
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": record.created,
+            "level": record.levelname,
+            "location": f"{record.module}.{record.funcName}:{record.lineno}",
+            "message": record.getMessage()
+        }
+        for key in EVENT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                data[key] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class EventRateLimitFilter(logging.Filter):
+    # Caps per-event info lines (records with an "action" extra) to a number per second.
+    # Runs on the caller's thread before the record is queued, so dropped lines cost almost nothing
+    def __init__(self, max_per_second: int):
+        super().__init__()
+        self.max_per_second = max_per_second
+        self._window = 0
+        self._count = 0
+        self._suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.max_per_second <= 0 or not hasattr(record, "action") or record.levelno > logging.INFO:
+            return True
+        window = int(monotonic())
+        if window != self._window:
+            self._window = window
+            self._count = 0
+        self._count += 1
+        if self._count > self.max_per_second:
+            self._suppressed += 1
+            return False
+        if self._suppressed > 0:
+            record.suppressed = self._suppressed
+            record.msg = f"{record.msg} ({self._suppressed} similar lines suppressed)"
+            self._suppressed = 0
+        return True
+
+
+class _PreformattedQueueHandler(QueueHandler):
+    # The default QueueHandler formats on the caller's thread. Leave that to the listener
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(logger: logging.Logger, log_format: str = "text", event_rate_limit: int = 0) -> QueueListener:
+    # Log records are put on a queue from the event loop and written to stdout by a background thread,
+    # so a slow or blocked stdout (journald, docker) can't stall the websocket
+    if log_format == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+
+    chandler = logging.StreamHandler(sys.stdout)
+    chandler.setLevel(logger.level)
+    chandler.setFormatter(formatter)
+
+    queue = SimpleQueue()
+    qhandler = _PreformattedQueueHandler(queue)
+    qhandler.setLevel(logger.level)
+    if event_rate_limit > 0:
+        qhandler.addFilter(EventRateLimitFilter(event_rate_limit))
+
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(qhandler)
+    logger.propagate = False
+
+    listener = QueueListener(queue, chandler, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -3,73 +3,107 @@
 import asyncio
 import json
 import logging
+import signal
 import sys
+from collections import Counter, deque
 from contextlib import suppress
-from time import sleep, time
-from traceback import format_tb
-from typing import Dict
+from datetime import datetime, timezone
+from functools import partial
+from time import monotonic, perf_counter, sleep
+from typing import TYPE_CHECKING, Dict, Optional, Union
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
 
-import disnake
-import websockets
 from aiohttp import ClientSession
-from requests import get
-from requests.exceptions import ConnectionError
-from websockets.legacy.client import WebSocketClientProtocol
 
+from conduit import Conduit
+from deadletter import DeadLetterQueue, ErrorGroup
+from events import Frame, decode_frame
+from handoff import Handoff, frame_key
+from logconfig import setup_logging
 from message import Message
 from messageparser import Parser
+from offenders import OffenderIndex
+from profiler import Profiler
+from sinks import Sink, build_sinks
 from streamer import Streamer
+from tokenpool import AUTH_URL, VALIDATE_INTERVAL, Account, TokenPool
+
+if TYPE_CHECKING:
+    # Imported when the transport needs them, the webhook server pulls in aiohttp.web and sessions pull in websockets
+    from webhookserver import WebhookServer
+    from wssession import EventSubSession
 
 
 class ConfigError(Exception):
     pass
 
-# https://id.twitch.tv/oauth2/authorize?client_id=CLIENT_ID&redirect_uri=https://twitchapps.com/tmi/&response_type=token&scope=moderator:manage:automod+moderator:read:blocked_terms+moderator:read:chat_settings+moderator:read:unban_requests+moderator:read:banned_users+moderator:read:chat_messages+moderator:read:warnings+moderator:read:moderators+moderator:read:vips
+# https://id.twitch.tv/oauth2/authorize?client_id=CLIENT_ID&redirect_uri=https://twitchapps.com/tmi/&response_type=token&scope=moderator:manage:automod+moderator:read:blocked_terms+moderator:read:chat_settings+moderator:read:unban_requests+moderator:read:banned_users+moderator:read:chat_messages+moderator:read:warnings+moderator:read:moderators+moderator:read:vips+user:read:moderated_channels
 
-DEFAULT_CONNECTION_URL = "wss://eventsub.wss.twitch.tv/ws"
 API_URL = "https://api.twitch.tv/helix"
+RECENT_WINDOW = 300 # How long handled events are remembered, for a successor to tell which ones it doesn't need to send
+SUBSCRIBE_TIMEOUT = 60 # How long a new instance waits for its own subscriptions before taking over anyway
+MAX_REPORTED_ERRORS = 3 # Kinds of error spelled out in one report, Discord caps how big an embed can be
 
 class PubSubLogging:
     def __init__(self):
         self.logging = logging.getLogger("Twitch Pubsub Logging")
         self.logging.setLevel(logging.INFO)
-        formatter = logging.Formatter(
-            "%(levelname)s [%(module)s %(funcName)s %(lineno)d]: %(message)s")
-
-        # Console logging
-        chandler = logging.StreamHandler(sys.stdout)
-        chandler.setLevel(self.logging.level)
-        chandler.setFormatter(formatter)
-        self.logging.addHandler(chandler)
 
-        self.queue = asyncio.Queue(maxsize=0)
         self._streamers: Dict[str, Streamer] = {}
         self._tasks: list[asyncio.Task] = []
         
-        self.connection_url: str = DEFAULT_CONNECTION_URL
-        self.last_message_time: float = 0
-        self.should_resubscribe: bool = True
-        self.current_session_id: str
-        self.current_user_id: str
         self.client_id: str
-        self.authorisation: str
-
-        # Read twitch authorization data
+        self.client_secret: Optional[str]
+        self.app_authorisation: Optional[str] = None
+        self.app_token_expires_at: float = 0
+        self.sessions: Dict[str, EventSubSession] = {}
+        self.webhook_server: Optional[WebhookServer] = None
+        self.conduit: Optional[Conduit] = None
+        self.conduit_subscribed: bool = False
+        self._recent: deque[tuple[float, Frame]] = deque()
+        self._buffer: Optional[list[Frame]] = None # Set while taking over from a previous instance
+        self._stopping: bool = False
+        self._alert_tasks: set[asyncio.Task] = set()
+        self._failed_subscriptions: set[str] = set() # Channels to retry after the next token validation
 
         try:
             with open("settings.json") as f:
                 channels = json.load(f)
         except FileNotFoundError:
             raise ConfigError("Unable to locate settings file!")
+
+        # Console logging, written from a background thread. Set up before anything else can log
+        try:
+            log_event_rate_limit = int(channels.get("_config", {}).get("log_event_rate_limit_per_second", 0))
+        except ValueError:
+            raise ConfigError("Log event rate limit is not a valid integer!")
+        self.log_listener = setup_logging(
+            self.logging, log_format=channels.get("_config", {}).get("log_format", "text"), event_rate_limit=log_event_rate_limit)
+        try:
+            self._configure(channels)
+        except BaseException:
+            self.log_listener.stop() # Its thread is a daemon, anything still queued would be lost as the error ends the process
+            raise
+
+    def _configure(self, channels: dict):
+        # Read twitch authorization data
         if not channels.get("authorization", None):
             raise ConfigError("Authorization not provided")
         try:  # Get authorization data
-            self.current_user_id = str(channels["authorization"]["id"])
-            self.authorisation = channels["authorization"]["auth_token"].split("oauth:", 1)[-1]
             self.client_id = channels["authorization"]["client_id"]
+            self.client_secret = channels["authorization"].get("client_secret", None) # Needed for the webhook and conduit transports, and to refresh tokens
+            # Either a single account in the authorization block itself, or a list of moderator accounts to spread channels across
+            accounts = [Account(
+                str(account["id"]), account["auth_token"].split("oauth:", 1)[-1], refresh_token=account.get("refresh_token", None) or None
+            ) for account in channels["authorization"].get("accounts", [channels["authorization"]])]
             del channels["authorization"]
         except KeyError:
             raise ConfigError("Unable to fetch user ID and Authorization Token!")
+        if not accounts:
+            raise ConfigError("No moderator accounts provided!")
+        self.tokens = TokenPool(self.client_id, self.client_secret, accounts, store_path=channels["_config"].get("token_store", "tokens.json"))
 
         # Read config options
 
@@ -86,15 +120,101 @@ class PubSubLogging:
         except ValueError:
             raise ConfigError("Uptime heartbeat frequency is not a valid integer!")
 
+        try:
+            self.profiler = Profiler(
+                output_dir=channels["_config"].get("profile_output_dir", "profiles"), window=int(channels["_config"].get("profile_window_seconds", 60)))
+        except ValueError:
+            raise ConfigError("Profile window is not a valid integer!")
+
+        # Websocket by default, the EventSub webhook transport with our own ingest server, or a websocket shard of a conduit
+        self.transport = channels["_config"].get("transport", "websocket")
+        if self.transport not in ("websocket", "webhook", "conduit"):
+            raise ConfigError(f"Unknown transport {self.transport}!")
+        if self.transport != "websocket" and not self.client_secret:
+            raise ConfigError(f"The {self.transport} transport needs the application's client_secret in the authorization section!")
+        if self.transport == "webhook":
+            webhook_config = channels["_config"].get("webhook", {})
+            if not webhook_config.get("callback_url", None) or not webhook_config.get("secret", None):
+                raise ConfigError("The webhook transport needs a callback_url and secret!")
+            self.webhook_callback_url: str = webhook_config["callback_url"]
+            self.webhook_secret: str = webhook_config["secret"]
+            from webhookserver import WebhookServer
+            try:
+                self.webhook_server = WebhookServer(
+                    self.webhook_secret, self.framehandler, self.exceptionhandler, host=webhook_config.get("host", "0.0.0.0"), port=int(webhook_config.get("port", 8080)), path=webhook_config.get("path", "/eventsub"))
+            except ValueError:
+                raise ConfigError("Webhook port is not a valid integer!")
+        if self.transport == "conduit":
+            conduit_config = channels["_config"].get("conduit", {})
+            self.conduit_id: Optional[str] = conduit_config.get("id", None) or None
+            try:
+                self.conduit_shard_count = int(conduit_config.get("shard_count", 1))
+                self.conduit_shard_id = int(conduit_config.get("shard_id", 0))
+            except ValueError:
+                raise ConfigError("Conduit shard count and shard id must be valid integers!")
+            if not 0 <= self.conduit_shard_id < self.conduit_shard_count:
+                raise ConfigError("Conduit shard id must be below the shard count!")
+            if self.conduit_shard_count > 1 and self.conduit_id is None:
+                # Every shard has to join the same conduit, and a fleet starting together would each create their own
+                raise ConfigError("A conduit id is needed to run more than one shard!")
+            # Subscriptions belong to the conduit, so only one shard of the fleet needs to create them
+            self.conduit_creates_subscriptions = bool(conduit_config.get("create_subscriptions", self.conduit_shard_id == 0))
+
+        # Accounts actioned across several of our channels get a note on their log entries, and optionally an alert
+        offender_config = channels["_config"].get("offenders", {})
+        try:
+            self.offenders: Optional[OffenderIndex] = OffenderIndex(
+                window=int(float(offender_config.get("window_minutes", 60)) * 60), max_actions=int(offender_config.get("max_tracked_actions", 100000)),
+                annotate_at=int(offender_config.get("annotate_other_channels", 1)), alert_at=int(offender_config.get("alert_other_channels", 0)))
+        except ValueError:
+            raise ConfigError("Offender window, thresholds and max tracked actions must be valid numbers!")
+        if self.offenders.window <= 0 or (self.offenders.annotate_at <= 0 and self.offenders.alert_at <= 0):
+            self.offenders = None # Nothing would use it, so don't keep it
+        self.offender_alert_webhooks: list[str] = offender_config.get("alert_webhooks", [])
+        if type(self.offender_alert_webhooks) == str:
+            self.offender_alert_webhooks = [self.offender_alert_webhooks]
+
+        # Frames that fail are saved for `main.py reprocess`, and streamers get a rate limited summary instead of an embed per failure
+        dead_letter_config = channels["_config"].get("dead_letter", {})
+        try:
+            self.dead_letters = DeadLetterQueue(
+                path=dead_letter_config.get("path", "deadletter.jsonl"), report_interval=float(dead_letter_config.get("report_interval_seconds", 300)))
+        except ValueError:
+            raise ConfigError("Dead letter report interval is not a valid number!")
+
+        # Where events go besides each streamer's Discord webhooks. Streamers pick from these by name
+        sink_config = channels["_config"].get("sinks", {})
+
+        # Graceful shutdown drains the sinks for up to drain_timeout_seconds, then saves what's left for the next start
+        shutdown_config = channels["_config"].get("shutdown", {})
+        try:
+            self.drain_timeout = float(shutdown_config.get("drain_timeout_seconds", 10))
+        except ValueError:
+            raise ConfigError("Shutdown drain timeout is not a valid number!")
+        self.handoff = Handoff(pid_file=shutdown_config.get("pid_file", "modlogging.pid"), state_file=shutdown_config.get("state_file", "pending.json"))
+
         del channels["_config"]
 
         try:
             failed_attempts = 0
+            account_index = 0
+            app_token: Optional[str] = None
             while True:
-                # Get information of each defined streamer, such as ID, icon, and display name
                 try:
-                    response = get(url=f"https://api.twitch.tv/helix/users?login={'&login='.join([channel for channel in channels.keys() if not channel.startswith('_')])}", headers={"Client-ID": self.client_id, "Authorization": f"Bearer {self.authorisation}"})
-                except ConnectionError:
+                    # Tokens are only validated and refreshed once the pool runs. If every user token has expired, an app token does for this
+                    if account_index == len(accounts) and app_token is None:
+                        app_token = self.fetch_app_token_blocking()
+                    token = accounts[account_index].auth_token if account_index < len(accounts) else app_token
+                    # Get information of each defined streamer, such as ID, icon, and display name
+                    request = Request(f"https://api.twitch.tv/helix/users?login={'&login='.join([channel for channel in channels.keys() if not channel.startswith('_')])}", headers={"Client-ID": self.client_id, "Authorization": f"Bearer {token}"})
+                    with urlopen(request, timeout=30) as response:
+                        json_obj = json.loads(response.read())
+                except HTTPError as e:
+                    if e.code == 401 and (account_index + 1 < len(accounts) or (account_index + 1 == len(accounts) and self.client_secret)):
+                        account_index += 1 # Expired token, any other account can look the streamers up
+                        continue
+                    json_obj = {}
+                except URLError:
                     if 2**failed_attempts > 128:
                         sleep(120)
                     else:
@@ -103,7 +223,6 @@ class PubSubLogging:
                     self.logging.warning(
                         f"{failed_attempts} failed attempts to fetch broadcaster data.")
                     continue
-                json_obj = response.json()
                 for user in json_obj["data"]: 
                     if type(channels[user["login"]]) == list: #If settings file is the old configuration.
                         webhooks = channels[user["login"]]
@@ -113,8 +232,11 @@ class PubSubLogging:
                         webhooks = channels[user["login"]]["webhooks"]
                         enable_automod = channels[user["login"]].get("enable_automod", False)
                         mod_action_whitelist = channels[user["login"]].get("mod_action_whitelist", [])
+                        sinks = channels[user["login"]].get("sinks", ["discord"])
+                        if type(sinks) == str:
+                            sinks = [sinks]
                         self._streamers[user['id']] = Streamer(
-                            user["login"], display_name=user["display_name"], icon=user["profile_image_url"], webhook_urls=webhooks, enable_automod=enable_automod, action_whitelist=mod_action_whitelist)
+                            user["login"], display_name=user["display_name"], icon=user["profile_image_url"], webhook_urls=webhooks, enable_automod=enable_automod, action_whitelist=mod_action_whitelist, sinks=sinks)
                 break
         except KeyError:
             raise ConfigError("Error during initialization. Check your client id and settings file!")
@@ -125,220 +247,521 @@ class PubSubLogging:
         if using_automod != []:
             self.logging.info(f"Listening for automod actions for: {', '.join(using_automod)}")
 
-        self.parser = Parser(self._streamers, use_embeds=use_embeds, ignored_mods=ignored_mods)
+        self.parser = Parser(self._streamers, use_embeds=use_embeds, ignored_mods=ignored_mods, profiler=self.profiler,
+                             offenders=self.offenders, on_offender_alert=self.offender_alert)
 
-    async def subscribe_to_events(self, session_id: str):
-        headers = {
-            "Authorization": f"Bearer {self.authorisation}",
+        try:
+            self.sinks: Dict[str, Sink] = build_sinks(sink_config, self.parser.automod_tracker, profiler=self.profiler)
+        except ValueError as e:
+            raise ConfigError(f"Invalid sink configuration, {e}!")
+        for streamer in self._streamers.values():
+            unknown = [name for name in streamer.sinks if name not in self.sinks]
+            if unknown:
+                raise ConfigError(f"{streamer} uses unknown sink{'' if len(unknown) == 1 else 's'} {', '.join(unknown)}!")
+
+    def fetch_app_token_blocking(self) -> str:
+        # refresh_app_token for before the event loop runs
+        request = Request(f"{AUTH_URL}/token", data=urlencode({
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "grant_type": "client_credentials"
+        }).encode())
+        with urlopen(request, timeout=30) as response:
+            return json.loads(response.read())["access_token"]
+
+    async def refresh_app_token(self):
+        # Client credentials flow, the webhook and conduit transports work with an app access token.
+        # Sent as a form rather than in the URL, so a failed request never logs the secret
+        r = await self.aioSession.post(f"{AUTH_URL}/token", data={
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "grant_type": "client_credentials"
+        })
+        r.raise_for_status()
+        data = await r.json()
+        self.app_authorisation = data["access_token"]
+        self.app_token_expires_at = monotonic() + data.get("expires_in", 0)
+
+    def api_headers(self, account: Optional[Account] = None) -> dict:
+        # Webhook and conduit subscriptions are created with the app access token, websocket ones with the moderator's user token
+        if self.transport == "websocket":
+            return self.tokens.headers(account)
+        return {
+            "Authorization": f"Bearer {self.app_authorisation}",
             "Client-ID": self.client_id,
         }
-        for c_id in list(self._streamers.keys()):
-            r1 = await self.aioSession.post(f"{API_URL}/eventsub/subscriptions", headers=headers, json={
-                "type": "channel.moderate",
-                "version": "2",
-                "condition": {
-                    "broadcaster_user_id": c_id,
-                    "moderator_user_id": self.current_user_id
-                },
-                "transport": {
-                    "method": "websocket",
-                    "session_id": session_id
-                }
-            })
-            r1.raise_for_status()
-            if self._streamers[c_id].enable_automod: #Subscribe to automod topics if enabled.
-                r2 = await self.aioSession.post(f"{API_URL}/eventsub/subscriptions", headers=headers, json={
-                    "type": "automod.message.hold",
-                    "version": "2",
-                    "condition": {
-                        "broadcaster_user_id": c_id,
-                        "moderator_user_id": self.current_user_id
-                    },
-                    "transport": {
-                        "method": "websocket",
-                        "session_id": session_id
-                    }
-                })
-                r2.raise_for_status()
-                r3 = await self.aioSession.post(f"{API_URL}/eventsub/subscriptions", headers=headers, json={
-                    "type": "automod.message.update",
+
+    def subscription_transport(self, session_id: Optional[str]) -> dict:
+        if self.transport == "conduit":
+            return self.conduit.transport()
+        if self.transport == "webhook":
+            return {
+                "method": "webhook",
+                "callback": self.webhook_callback_url,
+                "secret": self.webhook_secret
+            }
+        return {
+            "method": "websocket",
+            "session_id": session_id
+        }
+
+    async def subscribe_to_events(self, session_id: Optional[str] = None, account: Optional[Account] = None):
+        # A websocket session only carries its own account's channels, the other transports subscribe every channel
+        for c_id in list(account.assigned if account is not None else self._streamers.keys()):
+            await self.try_subscribe_channel(c_id, session_id)
+            await asyncio.sleep(0.05)
+        self.logging.debug("Events Subscribed")
+        self.logging.info("Ready" if account is None else f"Ready for {account}")
+
+    async def try_subscribe_channel(self, c_id: str, session_id: Optional[str] = None):
+        try:
+            await self.subscribe_channel(c_id, session_id)
+            self._failed_subscriptions.discard(c_id)
+        except Exception as e: # One channel failing shouldn't leave the rest unsubscribed
+            self.logging.error(f"Unable to subscribe to {self._streamers[c_id]}, retrying after the next token validation: {type(e).__name__}: {e}")
+            self._failed_subscriptions.add(c_id)
+
+    async def retry_failed_subscriptions(self):
+        # E.g. a reconnect while a token had expired gets a 401 for every channel, and validating has since refreshed it
+        for c_id in list(self._failed_subscriptions):
+            account = self.tokens.account_for(c_id)
+            if account is None or not account.valid:
+                continue # Moved to another account, or waiting for one
+            session_id = None
+            if self.transport == "websocket":
+                session = self.sessions.get(account.user_id, None)
+                if session is None or session.session_id is None:
+                    continue # Still connecting, its welcome subscribes everything assigned to it
+                session_id = session.session_id
+            self.logging.info(f"Retrying subscription to {self._streamers[c_id]}")
+            await self.try_subscribe_channel(c_id, session_id)
+
+    async def subscribe_channel(self, c_id: str, session_id: Optional[str] = None):
+        account = self.tokens.account_for(c_id)
+        if account is None:
+            return # No moderator account can see this channel, already logged when assigning
+        headers = self.api_headers(account)
+        topics = ["channel.moderate"]
+        if self._streamers[c_id].enable_automod: #Subscribe to automod topics if enabled.
+            topics += ["automod.message.hold", "automod.message.update"]
+        with self.profiler.span("subscribe", broadcaster_user_id=c_id, moderator_user_id=account.user_id):
+            for topic in topics:
+                r = await self.aioSession.post(f"{API_URL}/eventsub/subscriptions", headers=headers, json={
+                    "type": topic,
                     "version": "2",
                     "condition": {
                         "broadcaster_user_id": c_id,
-                        "moderator_user_id": self.current_user_id
+                        "moderator_user_id": account.user_id
                     },
-                    "transport": {
-                        "method": "websocket",
-                        "session_id": session_id
-                    }
+                    "transport": self.subscription_transport(session_id)
                 })
-                r3.raise_for_status()
-            await asyncio.sleep(0.05)
-        self.logging.debug("Events Subscribed")
-        self.logging.info("Ready")
+                if r.status == 409: # Webhook and conduit subscriptions outlive the process, so they may already exist
+                    continue
+                if r.status == 403:
+                    # Not a moderator there after all, e.g. when the moderated channel list couldn't be loaded
+                    self.logging.warning(f"{account} can't subscribe to {self._streamers[c_id]}, moving it to another account")
+                    await self.move_channel(c_id)
+                    return
+                r.raise_for_status()
 
     def run(self):
         self.loop = asyncio.new_event_loop()
         try:
             self.loop.run_until_complete(self.main())
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, asyncio.CancelledError):
             pass
         finally:
-            self.logging.info("Shutting down")
-            for task in self._tasks:
-                task.cancel()
-                # Now we should await task to execute it's cancellation.
-                # Cancelled task raises asyncio.CancelledError that we can suppress:
-                with suppress(asyncio.CancelledError):
-                    self.loop.run_until_complete(task)
-            self.loop.run_until_complete(self.aioSession.close())
-            # Takes forever to close
-            self.loop.run_until_complete(self.connection.close())
-        self.loop.close()
+            try:
+                self.logging.info("Shutting down")
+                for task in self._tasks:
+                    task.cancel()
+                    # Now we should await task to execute it's cancellation.
+                    # Cancelled task raises asyncio.CancelledError that we can suppress:
+                    with suppress(asyncio.CancelledError):
+                        self.loop.run_until_complete(task)
+                self.loop.run_until_complete(self.aioSession.close())
+                if self.webhook_server is not None:
+                    self.loop.run_until_complete(self.webhook_server.stop())
+                for session in self.sessions.values():
+                    self.loop.run_until_complete(session.close())
+                self.dead_letters.close()
+                self.handoff.release()
+                self.loop.close()
+            finally:
+                self.log_listener.stop() # Flush anything still queued for stdout, even if main() or the shutdown raised
 
     async def main(self):
+        self._main_task = asyncio.tasks.current_task()
         self.aioSession = ClientSession()
-        while True:
-            self.logging.debug("Connecting to websocket")
-            async for connection in websockets.connect(self.connection_url):
-                self.connection = connection
-                self.logging.info("Connected to websocket")
-                if self.connection_url != DEFAULT_CONNECTION_URL:
-                    self.connection_url = DEFAULT_CONNECTION_URL
-                self._tasks = [
-                    self.loop.create_task(self.twitch_heartbeat(connection)), # Twitch Pubsub requires occasional pings
-                    self.loop.create_task(self.message_reciever(connection)), # Recieves the messages from the websocket and parses them
-                    self.loop.create_task(self.worker(connection)) # Handles sending the messages created by the message reciever
-                ]
-                if self.robot_heartbeat_url and self.robot_heartbeat_frequency > 0:
-                    self._tasks += [
-                        self.loop.create_task(self.robot_heartbeat(connection)) # If configured, send occasional pings to uptimerobot
-                    ]
-                await asyncio.wait(self._tasks) # Tasks will run until the connection closes, we need to re-establish it if it closes
-
-    async def message_reciever(self, connection: WebSocketClientProtocol):
-        while not connection.closed:
+        self.tokens.session = self.aioSession
+        self.start_sinks()
+        self._tasks = [
+            *self._sink_tasks,
+            self.loop.create_task(self.dead_letters.writer()),
+            self.loop.create_task(self.dead_letters.reporter(self.send_error_report)),
+            self.loop.create_task(self.validate_tokens()), # Twitch requires tokens to be validated hourly
+            self.loop.create_task(self.parser.cleanup_automod())
+        ]
+        if self.robot_heartbeat_url and self.robot_heartbeat_frequency > 0:
+            self._tasks += [
+                self.loop.create_task(self.robot_heartbeat()) # If configured, send occasional pings to uptimerobot
+            ]
+
+        # kill -USR1 <pid> toggles profiling. Signal handlers aren't available on windows
+        with suppress(NotImplementedError, AttributeError):
+            self.loop.add_signal_handler(signal.SIGUSR1, self.profiler.toggle)
+            # Stop taking in events and deliver what's queued before exiting. Also how a new instance asks this one to hand over
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                self.loop.add_signal_handler(sig, lambda: self._tasks.append(self.loop.create_task(self.shutdown())))
+
+        # With a previous instance still running, subscribe alongside it and hold everything until it has let go
+        predecessor = self.handoff.predecessor()
+        if predecessor is not None:
+            self.logging.info(f"Taking over from running instance {predecessor}")
+            self._buffer = []
+        else:
+            self.handoff.claim()
+
+        # Check every token and work out which account handles which channel before anything is subscribed
+        await self.tokens.validate_all()
+        await self.tokens.load_moderated_channels(self._streamers.keys())
+        for c_id, account in self.tokens.assign(self._streamers.keys()).items():
+            self.logging.debug(f"{self._streamers[c_id]} assigned to {account}")
+
+        if self.transport == "webhook":
+            # The server has to be up before subscribing, Twitch verifies the callback while creating each subscription
+            await self.webhook_server.start()
+            await self.refresh_app_token()
+            await self.subscribe_to_events()
+        elif self.transport == "conduit":
+            await self.refresh_app_token()
+            self.conduit = Conduit(self.aioSession, self.api_headers, shard_count=self.conduit_shard_count, conduit_id=self.conduit_id)
+            await self.conduit.ensure()
+            self.start_session("conduit", self.on_conduit_session)
+        else:
+            # Websocket subscriptions belong to the token that created them, so every account gets its own connection
+            for account in self.tokens.accounts:
+                if account.assigned:
+                    self.start_account_session(account)
+
+        if predecessor is not None:
+            await self.take_over(predecessor)
+        else:
+            await self.replay(*self.handoff.load_state()) # Anything a previous shutdown couldn't deliver
+        await asyncio.wait(self._tasks)
+
+    def start_sinks(self):
+        # Every sink delivers from its own queue, so a slow one doesn't hold up the rest
+        self._sink_tasks: list[asyncio.Task] = []
+        for sink in self.sinks.values():
+            sink.session = self.aioSession
+            self._sink_tasks.append(self.loop.create_task(sink.run()))
+
+    async def stop_sinks(self, timeout: Optional[float] = None):
+        drains = [asyncio.create_task(sink.drain()) for sink in self.sinks.values()]
+        _, not_drained = await asyncio.wait(drains, timeout=timeout)
+        [task.cancel() for task in not_drained]
+        if not_drained:
+            behind = [str(sink) for sink, task in zip(self.sinks.values(), drains) if task in not_drained]
+            self.logging.warning(f"Sink{'' if len(behind) == 1 else 's'} {', '.join(behind)} not drained after {timeout:.0f} seconds")
+        for task in self._sink_tasks:
+            task.cancel()
+        await asyncio.gather(*self._sink_tasks, return_exceptions=True)
+
+    async def take_over(self, pid: int):
+        # Our subscriptions are live before the old instance drops its own, so there's no gap
+        waiters = [asyncio.create_task(session.ready.wait()) for session in self.sessions.values()]
+        if waiters:
+            _, not_ready = await asyncio.wait(waiters, timeout=SUBSCRIBE_TIMEOUT)
+            [task.cancel() for task in not_ready]
+            if not_ready:
+                self.logging.warning(f"{len(not_ready)} session{'' if len(not_ready) == 1 else 's'} not subscribed yet, taking over anyway")
+        await self.handoff.stop_predecessor(pid, self.drain_timeout + 10)
+        self.handoff.claim()
+        await self.replay(*self.handoff.load_state())
+        self.logging.info(f"Took over from instance {pid}")
+
+    async def replay(self, seen: Counter, pending: list[dict]):
+        # The previous instance's undelivered events first, each only to the sinks that missed it, then whatever we held that it never saw
+        if pending:
+            self.logging.info(f"Resending {len(pending)} event{'' if len(pending) == 1 else 's'} saved by the previous instance")
+        for entry in pending:
+            raw = entry.get("frame", entry) # Older versions saved bare frames, meant for every sink
             try:
-                message = await connection.recv()
-                self.last_message_time = time()
-                if type(message) == str:
-                    await self.messagehandler(message)
-                elif type(message) == bytes:
-                    await self.messagehandler(message.decode('utf-8'))
-                else:
-                    self.logging.error(f"Received invalid type {type(message)} from websocket")
-            except websockets.exceptions.ConnectionClosed:
-                self.logging.warning("Connection with server closed")
-                [task.cancel() for task in self._tasks if task is not asyncio.tasks.current_task()]
-
-    async def twitch_heartbeat(self, connection: WebSocketClientProtocol):
-        while not connection.closed:
-            await asyncio.sleep(30)
-            if self.last_message_time + 30 < time() and not connection.closed:
-                self.logging.info("Connection seems dead, restarting websocket")
-                await connection.close()
-                [task.cancel() for task in self._tasks if task is not asyncio.tasks.current_task()]
-
-    async def robot_heartbeat(self, connection: WebSocketClientProtocol):
-        while not connection.closed:
+                await self.notificationhandler(decode_frame(json.dumps(raw)), sinks=entry.get("sinks", None) if raw is not entry else None)
+            except Exception as e:
+                await self.exceptionhandler(e, raw, raw)
+        while self._buffer:
+            frame = self._buffer.pop(0)
+            key = frame_key(frame)
+            if seen[key] > 0:
+                seen[key] -= 1 # Counted, so a repeat of the same action that only we received still goes out
+                continue # Delivered by the previous instance, or in its pending list above
+            try:
+                await self.notificationhandler(frame)
+            except Exception as e:
+                await self.exceptionhandler(e, frame.raw, frame.raw)
+        self._buffer = None # Nothing awaits between the last check and here, so no frame can slip past
+
+    async def shutdown(self):
+        if self._stopping:
+            return
+        self._stopping = True
+        self.logging.info("Shutting down, delivering queued events")
+        # Stop intake first, so the queues can only shrink
+        for session in list(self.sessions.values()):
+            await session.close()
+        if self.webhook_server is not None:
+            await self.webhook_server.stop()
+        await self.stop_sinks(self.drain_timeout)
+        self.save_state()
+        self.handoff.release()
+        self._main_task.cancel() # Everything else is cancelled on the way out of run()
+
+    def save_state(self):
+        # One entry per event with the sinks it never reached. Batches cut off mid-write are included, so those may get some events twice
+        entries: Dict[int, tuple[Message, list[str]]] = {}
+        for name, sink in self.sinks.items():
+            for message in sink.pending():
+                entries.setdefault(id(message), (message, []))[1].append(name)
+        pending = [{"frame": message.frame.raw, "sinks": names} for message, names in sorted(entries.values(), key=lambda entry: entry[0].queued_at)]
+        pending += [{"frame": frame.raw} for frame in self._buffer or []]
+        seen = [frame_key(frame) for _, frame in self._recent]
+        try:
+            self.handoff.save_state(seen, pending)
+        except OSError as e:
+            self.logging.error(f"Unable to save state, {len(pending)} undelivered events lost: {e}")
+            return
+        if pending:
+            self.logging.warning(f"Saved {len(pending)} undelivered event{'' if len(pending) == 1 else 's'} for the next start")
+
+    def start_session(self, key: str, on_welcome, name: Optional[str] = None) -> "EventSubSession":
+        from wssession import EventSubSession
+        session = EventSubSession(name or key, on_welcome, self.framehandler, self.exceptionhandler)
+        self.sessions[key] = session
+        self._tasks.append(session.start())
+        return session
+
+    def start_account_session(self, account: Account) -> "EventSubSession":
+        return self.start_session(account.user_id, partial(self.subscribe_to_events, account=account), name=str(account))
+
+    async def on_conduit_session(self, session_id: str):
+        # A new session only needs this shard re-pointed at it, however many channels there are.
+        # Subscriptions are created once per process, and Twitch keeps them on the conduit between restarts
+        await self.conduit.assign_shard(self.conduit_shard_id, session_id)
+        if self.conduit_creates_subscriptions and not self.conduit_subscribed:
+            await self.subscribe_to_events()
+            self.conduit_subscribed = True
+        else:
+            self.logging.info("Ready")
+
+    async def validate_tokens(self):
+        while True:
+            await asyncio.sleep(VALIDATE_INTERVAL)
+            await self.tokens.validate_all()
+            if self.transport != "websocket":
+                # Renewed well before it expires, resubscribing after a revocation and re-pointing a conduit shard both need it
+                if self.app_token_expires_at - monotonic() < 2 * VALIDATE_INTERVAL:
+                    try:
+                        await self.refresh_app_token()
+                        self.logging.info("Refreshed app access token")
+                    except Exception as e:
+                        self.logging.warning(f"Unable to refresh app access token, retrying in an hour: {type(e).__name__}: {e}")
+                # App token subscriptions only depend on the moderator's grant, Twitch revokes them if that goes
+            else:
+                for account in self.tokens.accounts:
+                    if not account.valid:
+                        for c_id in list(account.assigned):
+                            await self.move_channel(c_id)
+            await self.retry_failed_subscriptions()
+
+    async def on_revocation(self, frame: Frame):
+        subscription = frame.subscription
+        self.logging.warning(f"Twitch revoked {subscription.type} subscription for {subscription.condition}: {subscription.status}")
+        if subscription.status not in ("authorization_revoked", "moderator_removed"):
+            return
+        c_id = subscription.condition.get("broadcaster_user_id", None)
+        account = self.tokens.account_for(c_id)
+        if account is None or account.user_id != subscription.condition.get("moderator_user_id", None):
+            return # Already moved, each topic of a channel is revoked separately
+        if subscription.status == "authorization_revoked":
+            account.valid = False # The moderator disconnected the app, none of their channels will work
+        await self.move_channel(c_id)
+
+    async def move_channel(self, c_id: str):
+        old = self.tokens.account_for(c_id)
+        account = self.tokens.failover(c_id)
+        if self.transport == "websocket":
+            if old is not None and not old.assigned and old.user_id in self.sessions:
+                await self.sessions.pop(old.user_id).close() # Nothing left on that account's connection
+            if account is None:
+                return
+            session = self.sessions.get(account.user_id, None)
+            if session is None:
+                self.start_account_session(account) # Its welcome subscribes everything assigned to it, this channel included
+            elif session.session_id is not None: # Otherwise still connecting, and the welcome picks it up
+                await self.try_subscribe_channel(c_id, session.session_id)
+        elif account is not None and (self.transport == "webhook" or self.conduit_creates_subscriptions):
+            await self.try_subscribe_channel(c_id)
+
+    async def robot_heartbeat(self):
+        while True: # Cancelled along with the other tasks on shutdown
             if self.robot_heartbeat_url and self.robot_heartbeat_frequency > 0:
                 self.logging.debug("Sending uptime heartbeat")
                 await self.aioSession.get(self.robot_heartbeat_url)
             # Sleep for defined value
             await asyncio.sleep(self.robot_heartbeat_frequency*60)
 
-    async def worker(self, connection: WebSocketClientProtocol):
-        while not connection.closed:
-            message: Message = await self.queue.get()
-            self.logging.debug(f"Recieved queue event")
-            if not message.ignore:  # Some messages can be ignored as duplicates are recieved etc
-                await message.send(session=self.aioSession)
-            self.queue.task_done()
-
-    async def messagehandler(self, raw_message: str):
+    async def framehandler(self, frame: Frame):
+        # Handles decoded frames from the websocket sessions and the webhook server
         try:
-            json_message = json.loads(str(raw_message))
-            metadata = json_message.get("metadata", {})
-            payload = json_message.get("payload", {})
-            if metadata["message_type"] == "session_welcome":
-                self.logging.debug("Welcome message received")
-                self.current_session_id = payload["session"]["id"]
-                if self.should_resubscribe:
-                    await self.subscribe_to_events(self.current_session_id)
-                self.should_resubscribe = True
-
-            # Twitch sends this message when it wants the client to reconnect, so we force disconnect and reconnect with the provided url
-            elif metadata["message_type"] == "session_reconnect":
-                self.logging.warning("Twitch requested reconnection")
-                self.connection_url = json_message["payload"]["session"]["reconnect_url"]
-                self.should_resubscribe = False
-                # Close the connection and let the code reconnect automatically
-                await self.connection.close()
-                [task.cancel() for task in self._tasks]
-
-            elif metadata["message_type"] == "notification":
-                self.logging.debug(json.dumps(json_message, indent=4))
-                # Data parser, along with all the switches for various mod actions
-                message = await self.parser.parse_message(json_message)
-                self.queue.put_nowait(message)
-
-            elif metadata["message_type"] == "session_keepalive":
-                return
+            metadata = frame.metadata
+            self.profiler.record("decode", *frame.decode_span, message_id=metadata.message_id)
+            if metadata.message_type == "notification":
+                if self._buffer is not None:
+                    self._buffer.append(frame) # Held until the previous instance says what it already handled
+                    return
+                await self.notificationhandler(frame)
+
+            elif metadata.message_type == "revocation":
+                await self.on_revocation(frame)
 
             else:
                 # Catch all other messages and log them to the console
-                self.logging.warning(f"Unhandled event!: {json.dumps(json_message, indent=4)}")
+                self.logging.warning(f"Unhandled event!: {json.dumps(frame.raw, indent=4)}")
 
         except Exception as e: #Catch every exception and send it to the associated streamer, if they can be gathered
-            formatted_exception = "Traceback (most recent call last):\n" + ''.join(
-                format_tb(e.__traceback__)) + f"{type(e).__name__}: {e}"
-            self.logging.error(formatted_exception)
+            await self.exceptionhandler(e, frame.raw, frame.raw)
+
+    async def notificationhandler(self, frame: Frame, sinks: Optional[list[str]] = None):
+        now = monotonic()
+        self._recent.append((now, frame))
+        while self._recent[0][0] < now - RECENT_WINDOW:
+            self._recent.popleft()
+        if self.logging.isEnabledFor(logging.DEBUG):
+            self.logging.debug(json.dumps(frame.raw, indent=4))
+        # Data parser, along with all the switches for various mod actions
+        message = await self.parser.parse_message(frame)
+        if message.ignore:  # Some messages can be ignored as duplicates are recieved etc
+            return
+        # Parsed and rendered once, then handed to each of the streamer's sinks. A replayed event only goes to the ones that missed it
+        message.queued_at = perf_counter()
+        for name in message.streamer.sinks if sinks is None else sinks:
+            sink = self.sinks.get(name, None)
+            if sink is not None:
+                await sink.put(message)
+
+    def offender_alert(self, streamer: Streamer, user: str, others: list[str]):
+        # Called from the parser, so sending is left to a task rather than holding up the event
+        self.logging.warning(f"{user} has been actioned in {len(others) + 1} channels in the last {self.offenders.window_text}, most recently #{streamer}")
+        if self.offender_alert_webhooks:
+            task = asyncio.create_task(self.send_offender_alert(streamer, user, others))
+            self._alert_tasks.add(task)
+            task.add_done_callback(self._alert_tasks.discard)
+
+    async def send_offender_alert(self, streamer: Streamer, user: str, others: list[str]):
+        discord = self.parser.discord  # disnake, or litewebhook in text mode
+        user_escaped = user.lower().replace('_', r'\_')
+        channels = ", ".join(f"[{c.replace('_', r'\_')}](<https://www.twitch.tv/popout/{c}/viewercard/{user.lower()}>)" for c in others + [streamer.username])
+        description = f"Actioned in {len(others) + 1} channels in the last {self.offenders.window_text}"
+        if self.parser.use_embeds:
+            embed = discord.Embed(title="Repeat Offender", description=description, color=self.parser.colour.orange, timestamp=datetime.now(timezone.utc))
+            embed.add_field(name="Flagged Account", value=user_escaped, inline=True)
+            embed.add_field(name="Channels", value=channels, inline=False)
+            content = {"embed": embed}
+        else:
+            content = {"content": f"**Repeat Offender** **||** **Flagged Account:** {user_escaped} **||** {description}\nChannels: {channels}"}
+        for url in self.offender_alert_webhooks:
+            try:
+                await discord.Webhook.from_url(url, session=self.aioSession).send(**content, allowed_mentions=discord.AllowedMentions.none())
+            except discord.NotFound:
+                self.logging.warning("Offender alert webhook not found")
+            except discord.HTTPException as e:
+                self.logging.error(f"HTTP Exception sending offender alert: {e}")
+
+    async def exceptionhandler(self, e: Exception, json_message: Optional[dict], raw_message: Union[str, bytes, dict]):
+        # json_message is the already decoded frame when there is one. Nothing here awaits, failures are queued to be
+        # written and reported later so a burst of bad events can't hold up receiving
+        streamer_id = None
+        with suppress(KeyError, TypeError, AttributeError):
+            streamer_id = json_message["payload"]["subscription"]["condition"]["broadcaster_user_id"]
+        self.dead_letters.add(e, json_message, raw_message, streamer_id=streamer_id if streamer_id in self._streamers else None)
+
+    async def send_error_report(self, streamer_id: str, groups: list[ErrorGroup]):
+        streamer = self._streamers[streamer_id]
+        groups.sort(key=lambda group: group.count, reverse=True)
+        total = sum(group.count for group in groups)
+        discord = self.parser.discord  # disnake, or litewebhook in text mode
+        description = f"If you see this something went wrong with the data from Twitch, or how it is being handled. {total} event{'' if total == 1 else 's'} failed"
+        if len(groups) > MAX_REPORTED_ERRORS:
+            description += f", {len(groups) - MAX_REPORTED_ERRORS} more kind{'' if len(groups) - MAX_REPORTED_ERRORS == 1 else 's'} of error not shown here"
+        description += f". Failed events are saved to `{self.dead_letters.path}` and can be sent again with `python3 main.py reprocess` once fixed."
+        embed = discord.Embed(
+            title=f"Safety Embed",
+            description=description,
+            color=0x880080,
+            timestamp=datetime.now(timezone.utc)
+        )
+        for group in groups[:MAX_REPORTED_ERRORS]:
+            embed.add_field(
+                name=f"{group.count}x {group.error}"[:256], value=f"```python\n{group.traceback[-1000:]}```", inline=False)
+        if groups[0].sample is not None:
+            # Remove null values to save space
+            exclude_these_keys = ['broadcaster_user_id', 'broadcaster_user_login', 'broadcaster_user_name', 'user_name', 'moderator_user_name']
+            minimised = {k: v for k, v in groups[0].sample.items() if v is not None and k not in exclude_these_keys}
+            if isinstance(minimised.get("message", None), dict):
+                minimised["message"] = {k: v for k, v in minimised["message"].items() if k != "fragments"}
+            embed.add_field(
+                name="Debug Data", value=f"`{json.dumps(minimised)[:1000]}`", inline=False)
+        embed.set_footer(text="Sad", icon_url=streamer.icon)
+        for webhook in streamer.webhook_urls:
+            try:
+                await discord.Webhook.from_url(webhook, session=self.aioSession).send(embed=embed)
+            except discord.NotFound:
+                self.logging.error(f"Webhook not found for {streamer}")
+            except discord.HTTPException as e:
+                self.logging.error(f"HTTP Exception sending webhook: {e}")
+
+    def reprocess(self):
+        # python3 main.py reprocess: sends everything in the dead-letter queue through the parser and sinks again, then exits.
+        # Can run alongside the logger, anything still failing goes back in the queue
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self._reprocess())
+        except KeyboardInterrupt:
+            pass
+        finally:
             try:
-                json_message = json.loads(raw_message)
+                self.dead_letters.close()
+                self.loop.run_until_complete(self.aioSession.close())
+                self.loop.close()
+            finally:
+                self.log_listener.stop()
 
-                # If payload is empty we have no broadcaster to go by so just log and continue
-                if json_message.get("payload", {}) == {}:
-                    self.logging.error(json.dumps(raw_message, indent=4))
-                    return
-                
-                streamer_id = json_message["payload"]["subscription"]["condition"]["broadcaster_user_id"]
-                streamer = self._streamers[streamer_id]
-                # Remove null values to save space
-                exclude_these_keys = ['broadcaster_user_id', 'broadcaster_user_login', 'broadcaster_user_name', 'user_name', 'moderator_user_name']
-                minimised = {k: v for k, v in json_message["payload"]["event"].items() if v is not None and k != exclude_these_keys}
-                try:
-                    del minimised["message"]["fragments"]
-                except KeyError:
-                    self.logging.warning("Error removing message fragments from error payload")
-                embed = disnake.Embed(
-                    title=f"Safety Embed",
-                    description=f"If you see this something went wrong with the data from Twitch, or how it is being handled.",
-                    color=0x880080,
-                    timestamp=disnake.utils.utcnow()
-                )
-                embed.add_field(
-                    name="Traceback", value=f"```python\n{formatted_exception}```", inline=False)
-                embed.add_field(
-                    name="Debug Data", value=f"`{json.dumps(minimised)}`", inline=False)
-
-                webhooks = []
-                for webhook in streamer.webhook_urls:
-                    webhooks.append(disnake.Webhook.from_url(
-                        webhook, session=self.aioSession))
-                embed.set_footer(text="Sad", icon_url=streamer.icon)
-                for webhook in webhooks:
-                    try:
-                        await webhook.send(embed=embed)
-                    except disnake.NotFound:
-                        self.logging.error(f"Webhook not found for {streamer}")
-                    except disnake.HTTPException as e:
-                        self.logging.error(f"HTTP Exception sending webhook: {e}")
-            except Exception as ee:
-                self.logging.error("Exception handling exception message")
-                formatted_nested_exception = "Traceback (most recent call last):\n" + ''.join(
-                format_tb(ee.__traceback__)) + f"{type(ee).__name__}: {ee}"
-                self.logging.error(formatted_nested_exception)
+    async def _reprocess(self):
+        self.aioSession = ClientSession()
+        self.start_sinks()
+        writer = asyncio.create_task(self.dead_letters.writer())
+        records = self.dead_letters.take()
+        self.logging.info(f"Reprocessing {len(records)} dead letter{'' if len(records) == 1 else 's'}")
+        failed = 0
+        for record in records:
+            raw = record.get("frame", None) or record.get("raw", None)
+            try:
+                await self.notificationhandler(decode_frame(raw if isinstance(raw, str) else json.dumps(raw)))
+            except Exception as e:
+                failed += 1
+                await self.exceptionhandler(e, raw if isinstance(raw, dict) else getattr(e, "raw", None), raw)
+        await self.stop_sinks()
+        await self.dead_letters.flush()
+        writer.cancel()
+        self.dead_letters.done()
+        self.logging.info(f"Reprocessed {len(records) - failed} dead letter{'' if len(records) - failed == 1 else 's'}"
+                          + (f", {failed} failed again and {'was' if failed == 1 else 'were'} put back" if failed else ""))
 
 if __name__ == "__main__":
     p = PubSubLogging()
-    p.run()
+    if sys.argv[1:2] == ["reprocess"]:
+        p.reprocess()
+    else:
+        p.run()
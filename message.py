@@ -1,20 +1,33 @@
+from __future__ import annotations
+
 import logging
 from datetime import datetime
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
 
-import disnake
 from aiohttp import ClientSession
 
+from automodtracker import AutomodState
+from events import Frame
 from modactions import ModAction
 from streamer import Streamer
 
+try:
+    from orjson import dumps as _dumps
+except ImportError:
+    from json import dumps
+
+    def _dumps(obj) -> bytes:
+        return dumps(obj, separators=(",", ":"), default=str).encode()
+
 if TYPE_CHECKING:
+    import disnake
+
     from messageparser import Parser
 
 class Message:
-    def __init__(self, parser, raw, streamer, mod_action, ignore, embed, embed_text, **kwargs):
+    def __init__(self, parser, frame, streamer, mod_action, ignore, embed, embed_text, **kwargs):
         self._parser: Parser = parser
-        self.__raw_message: dict = raw
+        self.__frame: Frame = frame
         self.logging = logging.getLogger("Twitch Pubsub Logging")
         self.__streamer: Streamer = streamer
         self.__mod_action: str = mod_action
@@ -22,6 +35,9 @@ class Message:
         self.__embed: disnake.Embed = embed
         self.__embed_text: str = embed_text
         self.__created_at = datetime.utcnow()
+        self.queued_at: float = 0  # perf_counter() when handed to the sinks
+        self.__record: Optional[dict] = None
+        self.__record_json: Optional[bytes] = None
 
         self.footer_message: str = "Mew"
 
@@ -49,47 +65,129 @@ class Message:
     def ignore(self):
         return self.__ignore_message
 
+    @property
+    def frame(self):
+        return self.__frame
+
+    @property
+    def message_id(self):
+        return self.__frame.metadata.message_id
+
+    @property
+    def automod_message_id(self):
+        return self.__frame.event.message_id
+
+    @property
+    def record(self) -> dict:
+        # What the non-Discord sinks write. Built once, however many of them the event goes to
+        if self.__record is None:
+            event = self.__frame.raw["payload"].get("event", {})
+            self.__record = {
+                "id": self.message_id,
+                "timestamp": self.__frame.metadata.message_timestamp,
+                "type": self.__frame.subscription.type,
+                "streamer": self.__streamer.username,
+                "action": self.__mod_action.value,
+                "moderator": event.get("moderator_user_login", None),
+                "text": self.__embed_text,
+                "embed": self.__embed.to_dict() if self.__embed is not None else None,
+                "event": event
+            }
+        return self.__record
+
+    @property
+    def record_json(self) -> bytes:
+        if self.__record_json is None:
+            self.__record_json = _dumps(self.record)
+        return self.__record_json
+
+    def _content(self) -> dict:
+        if self._parser.use_embeds:
+            return {"embed": self.__embed}
+        return {"content": self.__embed_text}
+
+    async def _post(self, webhook: disnake.Webhook, content: dict, wait: bool = False):
+        discord = self._parser.discord  # disnake, or litewebhook in text mode
+        try:
+            return await webhook.send(**content, allowed_mentions=discord.AllowedMentions.none(), wait=wait)
+        except discord.NotFound:
+            self.logging.warning(
+                f"Webhook not found for {self.streamer.username}")
+        except discord.HTTPException as e:
+            self.logging.error(f"HTTP Exception sending webhook: {e}")
+
+    async def _edit(self, w_message: disnake.WebhookMessage, content: dict):
+        discord = self._parser.discord
+        try:
+            await w_message.edit(**content, allowed_mentions=discord.AllowedMentions.none())
+        except discord.NotFound:
+            pass
+        except discord.HTTPException as e:
+            self.logging.error(f"HTTP Exception editing webhook message: {e}")
+
     async def send(self, session=None):
         close_when_done = False
         if session is None:
             session = ClientSession()
             close_when_done = True
-        session = session or ClientSession()
         webhooks = []
         for webhook in self.streamer.webhook_urls:
-            webhooks.append(disnake.Webhook.from_url(
+            webhooks.append(self._parser.discord.Webhook.from_url(
                 webhook, session=session))
-            
+
         self.__embed.set_footer(text=self.footer_message, icon_url=self.__streamer.icon)
-        for webhook in webhooks:
-            try:
-                if self.mod_action == ModAction.automod_allowed_message or self.mod_action == ModAction.automod_denied_message:
-                    existing = self._parser.automod_cache.get(self.__raw_message["payload"]["event"]["message_id"], None)
-                    if existing: #If we found the older message in the cache, update it :)
-                        try:
-                            if self._parser.use_embeds:
-                                await existing["message"].edit(embed=self.__embed, allowed_mentions=disnake.AllowedMentions.none())
-                            else:
-                                await existing["message"].edit(content=self.__embed_text, allowed_mentions=disnake.AllowedMentions.none())
-                        except disnake.NotFound:
-                            pass
-                        del self._parser.automod_cache[self.__raw_message["payload"]["event"]["message_id"]]
-                    else: #If it's not in the cache for some reason just send it as normal
-                        if self._parser.use_embeds:
-                            w_message = await webhook.send(embed=self.__embed, allowed_mentions=disnake.AllowedMentions.none())
-                        else:
-                            w_message = await webhook.send(content=self.__embed_text, allowed_mentions=disnake.AllowedMentions.none())
-                else:
-                    if self._parser.use_embeds:
-                        w_message = await webhook.send(embed=self.__embed, allowed_mentions=disnake.AllowedMentions.none(), wait=True)
-                    else:
-                        w_message = await webhook.send(content=self.__embed_text, allowed_mentions=disnake.AllowedMentions.none(), wait=True)
-                    if self.mod_action == ModAction.automod_caught_message:
-                        self._parser.automod_cache.update({self.__raw_message["payload"]["event"]["message_id"]: {"object": self, "message": w_message}})
-            except disnake.NotFound:
-                self.logging.warning(
-                    f"Webhook not found for {self.streamer.username}")
-            except disnake.HTTPException as e:
-                self.logging.error(f"HTTP Exception sending webhook: {e}")
+        if self.mod_action == ModAction.automod_caught_message:
+            await self._send_automod_hold(webhooks)
+        elif self.mod_action == ModAction.automod_allowed_message or self.mod_action == ModAction.automod_denied_message:
+            await self._send_automod_resolution(webhooks)
+        else:
+            for webhook in webhooks:
+                await self._post(webhook, self._content())
         if close_when_done:
-            await session.close()
\ No newline at end of file
+            await session.close()
+
+    async def _send_automod_hold(self, webhooks: list[disnake.Webhook]):
+        tracker = self._parser.automod_tracker
+        entry = tracker.get(self.automod_message_id)
+        if entry is None or entry.hold is not self:  # Not tracked, just post it
+            for webhook in webhooks:
+                await self._post(webhook, self._content())
+            return
+        if entry.resolution is not None:
+            # Resolved while still queued, post the final state once instead of posting and editing
+            tracker.pop(self.automod_message_id)
+            await entry.resolution._send_resolved(webhooks)
+            return
+        entry.state = AutomodState.sending
+        try:
+            for webhook in webhooks:
+                w_message = await self._post(webhook, self._content(), wait=True)
+                if w_message is not None:
+                    entry.messages.append(w_message)
+        except Exception:
+            # Nothing will edit a hold that failed to go out, so forget it and post a resolution that was waiting on it by itself
+            tracker.pop(self.automod_message_id)
+            if entry.resolution is not None:
+                try:
+                    await entry.resolution._send_resolved(webhooks, entry.messages)
+                except Exception as e:
+                    self.logging.error(f"Unable to send automod resolution: {type(e).__name__}: {e}")
+            raise
+        entry.state = AutomodState.delivered
+        if entry.resolution is not None:
+            # Resolution arrived mid-send, apply it now so the edit always lands after the post
+            tracker.pop(self.automod_message_id)
+            await entry.resolution._send_resolved(webhooks, entry.messages)
+
+    async def _send_automod_resolution(self, webhooks: list[disnake.Webhook]):
+        entry = self._parser.automod_tracker.pop(self.automod_message_id)
+        await self._send_resolved(webhooks, entry.messages if entry is not None else [])
+
+    async def _send_resolved(self, webhooks: list[disnake.Webhook], existing: Optional[list] = None):
+        self.__embed.set_footer(text=self.footer_message, icon_url=self.__streamer.icon)
+        if existing:  # If we found the older messages, update them :)
+            for w_message in existing:
+                await self._edit(w_message, self._content())
+        else:  # If the hold was never posted just send it as normal
+            for webhook in webhooks:
+                await self._post(webhook, self._content())
@@ -1,14 +1,21 @@
+from __future__ import annotations
+
 import asyncio
 import logging
-from datetime import datetime, timedelta
-
-import disnake
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Optional
 
+from automodtracker import AutomodTracker
+from events import AutomodEvent, Frame, Metadata, ModerateEvent
 from message import Message
 from modactions import ModAction
+from offenders import OffenderIndex
+from profiler import Profiler
 from streamer import Streamer
 from typing import Tuple
-from humanize import precisedelta
+
+if TYPE_CHECKING:
+    import disnake
 
 
 class Colours:
@@ -25,6 +32,16 @@ class Parser:
         self.streamers = streamers
         self.ignored_mods = kwargs.get("ignored_mods", [])
         self.use_embeds = kwargs.get("use_embeds", True)
+        # Text mode only ever sends plain strings, so it skips importing the full Discord library
+        if self.use_embeds:
+            import disnake as discord
+        else:
+            import litewebhook as discord
+        self.discord = discord
+        self.profiler: Profiler = kwargs.get("profiler", None) or Profiler()
+        # Cross-channel memory of banned, timed out and warned accounts. on_offender_alert(streamer, user, channels) is called when one crosses the alert threshold
+        self.offenders: Optional[OffenderIndex] = kwargs.get("offenders", None)
+        self.on_offender_alert = kwargs.get("on_offender_alert", None)
         self.colour = Colours()
         self._chatroom_actions = {
             ModAction.slow: "Slow Chat Mode Enabled",
@@ -43,92 +60,93 @@ class Parser:
             ModAction.raid: "Raid Action",
             ModAction.unraid: "Unraid Action"
         }
-        self.automod_cache = {}
-        self.loop = asyncio.get_event_loop()
-        self.loop.create_task(self.cleanup_automod())
+        self.automod_tracker = AutomodTracker()
 
     async def cleanup_automod(self):
+        # Started by the caller once its loop is running
         while True:
             await asyncio.sleep(360)
-            count = 0
-            for id, i in dict(self.automod_cache).items():
-                if i["object"].created_at.timestamp() > datetime.utcnow().timestamp() - AUTOMOD_TIMEOUT:
-                    del self.automod_cache[id]
-                    count += 1
+            count = self.automod_tracker.cleanup(AUTOMOD_TIMEOUT)
             if count > 0:
                 self.logging.info(f"Cleaned up {count} unanswered events")
 
-    async def parse_message(self, data: dict) -> Message:
-        metadata = data["metadata"]
-        subscription = data["payload"]["subscription"]
-        event = data["payload"]["event"]
-        streamer: Streamer = self.streamers[event["broadcaster_user_id"]]
+    async def parse_message(self, frame: Frame) -> Message:
+        metadata = frame.metadata
+        subscription = frame.subscription
+        event = frame.event
+        streamer: Streamer = self.streamers[event.broadcaster_user_id]
         ignore_message = False
 
-        embed = disnake.Embed(timestamp=disnake.utils.utcnow())
+        embed = self.discord.Embed(timestamp=datetime.now(timezone.utc))
 
         embed.add_field(
             name="Channel", value=f"[{streamer.display_name}](<https://www.twitch.tv/{streamer.username}>)", inline=True)  # Every embed should have the channel link
         
-        if subscription["type"] == "automod.message.hold":
+        if subscription.type == "automod.message.hold":
             mod_action_str = "automod_caught_message"
             moderator = "Automod"
-        elif subscription["type"] == "automod.message.update": 
-            if event["status"] == "approved":
+        elif subscription.type == "automod.message.update": 
+            if event.status == "approved":
                 mod_action_str = "automod_allowed_message"
             else:
                 mod_action_str = "automod_denied_message"
-            moderator = event["moderator_user_name"]
+            moderator = event.moderator_user_name
         else:
-            mod_action_str = event["action"]
-            moderator = event["moderator_user_name"]
+            mod_action_str = event.action
+            moderator = event.moderator_user_name
 
         embed.add_field(name="Moderator", value=moderator, inline=True)
 
-        try:
-            mod_action = ModAction(mod_action_str)
-            mod_action_func = getattr(self, mod_action.value)
-            r = mod_action_func(streamer, event, metadata, mod_action, embed)
-            if type(r) == tuple:
-                embed = r[1]
-                ignore_message = r[0]
+        with self.profiler.span("parse", message_id=metadata.message_id):
+            try:
+                mod_action = ModAction(mod_action_str)
+                mod_action_func = getattr(self, mod_action.value)
+                r = mod_action_func(streamer, event, metadata, mod_action, embed)
+                if type(r) == tuple:
+                    embed = r[1]
+                    ignore_message = r[0]
+                else:
+                    embed = r
+            except AttributeError:
+                embed.add_field(name="UNKNOWN ACTION", value=f"`{mod_action_str}`", inline=False)
+                embed.title = "Unknown Mod Action"
+
+        with self.profiler.span("filter", message_id=metadata.message_id):
+            if moderator in self.ignored_mods:
+                ignore_message = True
+
+            #Ignores
+            if mod_action.value not in streamer.action_whitelist and streamer.action_whitelist != [] and mod_action != ModAction.automod_caught_message: #Automod ignoring handled seperately
+                ignore_message = True
+
+        with self.profiler.span("render", message_id=metadata.message_id):
+            # Make the text version out of the embed. This is shitty, I know. Works surprisingly well though, for now...
+            d = embed.to_dict()
+            embed_text = "\n"
+            if d.get("title", None) is not None:
+                embed_text += f"**{d.get('title', '')}**"
+            for field in d.get("fields", []):
+                if field["name"] == "Channel":
+                    embed_text += f" **||** **Channel:** {field['value']}"
+                elif field["name"] == "Moderator":
+                    embed_text += f" **||** **Moderator:** {field['value']}"
+            if d.get("description", None) is not None:
+                embed_text += f" **||** {d.get('description', '')}\n"
             else:
-                embed = r
-        except AttributeError:
-            embed.add_field(name="UNKNOWN ACTION", value=f"`{mod_action_str}`", inline=False)
-            embed.title = "Unknown Mod Action"
-
-        if moderator in self.ignored_mods:
-            ignore_message = True
-
-        #Ignores
-        if mod_action.value not in streamer.action_whitelist and streamer.action_whitelist != [] and mod_action != ModAction.automod_caught_message: #Automod ignoring handled seperately
-            ignore_message = True
-
-        # Make the text version out of the embed. This is shitty, I know. Works surprisingly well though, for now...
-        d = embed.to_dict()
-        embed_text = "\n"
-        if d.get("title", None) is not None:
-            embed_text += f"**{d.get('title', '')}**"
-        for field in d.get("fields", []):
-            if field["name"] == "Channel":
-                embed_text += f" **||** **Channel:** {field['value']}"
-            elif field["name"] == "Moderator":
-                embed_text += f" **||** **Moderator:** {field['value']}"
-        if d.get("description", None) is not None:
-            embed_text += f" **||** {d.get('description', '')}\n"
-        else:
-            embed_text += "\n"
-        embed_text += '\n'.join([f"{i['name']}: {i['value']}" for i in d.get('fields', []) if i["name"] != "Moderator" and i["name"] != "Channel"])
+                embed_text += "\n"
+            embed_text += '\n'.join([f"{i['name']}: {i['value']}" for i in d.get('fields', []) if i["name"] != "Moderator" and i["name"] != "Channel"])
 
-        self.logging.info(f"{moderator} used {mod_action.value} in #{streamer.username}")
+        if self.logging.isEnabledFor(logging.INFO):
+            latency = round((datetime.now(timezone.utc) - datetime.fromisoformat(metadata.message_timestamp)).total_seconds(), 3)
+            self.logging.info("%s used %s in #%s", moderator, mod_action.value, streamer.username,
+                              extra={"streamer": streamer.username, "action": mod_action.value, "moderator": moderator, "latency": latency})
 
-        return Message(self, data, streamer, mod_action, ignore_message, embed, embed_text)
+        return Message(self, frame, streamer, mod_action, ignore_message, embed, embed_text)
 
     # More generic functions that the specifics call
 
-    def set_user_attrs(self, streamer: Streamer, event: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
-        user = event[mod_action.name.replace("approve_", "").replace("deny_", "")]["user_login"]
+    def set_user_attrs(self, streamer: Streamer, event: ModerateEvent, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+        user = event.target.user_login
         user_escaped = user.lower().replace('_', r'\_')
         embed.title = f"Mod {mod_action.value.replace('_', ' ').title()} Action"
         #embed.description=f"[Review Viewercard for User](<https://www.twitch.tv/popout/{streamer.username}/viewercard/{user.lower()}>)"
@@ -137,14 +155,27 @@ class Parser:
             name="Flagged Account", value=f"[{user_escaped}](<https://www.twitch.tv/popout/{streamer.username}/viewercard/{user_escaped}>)", inline=True)
         return embed
 
+    def set_offender_attrs(self, streamer: Streamer, event: ModerateEvent, embed: disnake.Embed) -> disnake.Embed:
+        if self.offenders is None:
+            return embed
+        user = event.target.user_login
+        others, alert = self.offenders.record(user, streamer.username)
+        if alert and self.on_offender_alert is not None:
+            self.on_offender_alert(streamer, user, others)
+        if self.offenders.annotate_at > 0 and len(others) >= self.offenders.annotate_at:
+            channels = ", ".join(c.replace('_', r'\_') for c in others[:5]) + (f" and {len(others) - 5} more" if len(others) > 5 else "")
+            embed.add_field(
+                name="Other Channels", value=f"Actioned in {len(others)} other channel{'' if len(others) == 1 else 's'} in the last {self.offenders.window_text}: {channels}", inline=False)
+        return embed
+
     def set_terms_attrs(self, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed.title = f"Mod {mod_action.value.replace('_', ' ').title()} Action"
         embed.color = self.colour.red
         return embed
 
-    def set_appeals_attrs(self, streamer: Streamer, event: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def set_appeals_attrs(self, streamer: Streamer, event: ModerateEvent, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         self.set_user_attrs(streamer, event, mod_action, embed)
-        moderator_reason = event[mod_action.name.replace("approve_", "").replace("deny_", "")]['moderator_message'] if event[mod_action.name.replace("approve_", "").replace("deny_", "")]['moderator_message'] != '' else 'None Provided'
+        moderator_reason = event.target.moderator_message or "None Provided"
         embed.add_field(
             name="Moderator Reason", value=f"`{moderator_reason}`", inline=False)
         return embed
@@ -156,72 +187,73 @@ class Parser:
 
     # Action type specific functions that are fetched using getattr()
 
-    def approve_unban_request(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def approve_unban_request(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed.colour = self.colour.green
         return self.set_appeals_attrs(streamer, event, mod_action, embed)
 
-    def deny_unban_request(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def deny_unban_request(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         return self.set_appeals_attrs(streamer, event, mod_action, embed)
 
-    def slow(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def slow(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed = self.set_chatroom_attrs(mod_action, embed)
         embed.add_field(
-            name=f"Slow Amount (second{'' if event[mod_action.name]['wait_time_seconds'] == 1 else 's'})", value=f"`{event[mod_action.name]['wait_time_seconds']}`", inline=True)
+            name=f"Slow Amount (second{'' if event.target.wait_time_seconds == 1 else 's'})", value=f"`{event.target.wait_time_seconds}`", inline=True)
         return embed
 
-    def slowoff(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def slowoff(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         return self.set_chatroom_attrs(mod_action, embed)
 
-    def uniquechat(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def uniquechat(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         return self.set_chatroom_attrs(mod_action, embed)
 
-    def uniquechatoff(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def uniquechatoff(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         return self.set_chatroom_attrs(mod_action, embed)
 
-    def clear(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def clear(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         return self.set_chatroom_attrs(mod_action, embed)
 
-    def emoteonly(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def emoteonly(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         return self.set_chatroom_attrs(mod_action, embed)
 
-    def emoteonlyoff(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def emoteonlyoff(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         return self.set_chatroom_attrs(mod_action, embed)
 
-    def subscribers(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def subscribers(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         return self.set_chatroom_attrs(mod_action, embed)
 
-    def subscribersoff(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def subscribersoff(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         return self.set_chatroom_attrs(mod_action, embed)
 
-    def followers(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def followers(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed = self.set_chatroom_attrs(mod_action, embed)
         embed.add_field(
-            name=f"Time Needed to be Following (minute{'' if int(event[mod_action.name]['follow_duration_minutes']) == 1 else 's'})", value=f"`{event[mod_action.name]['follow_duration_minutes']}`", inline=True)
+            name=f"Time Needed to be Following (minute{'' if event.target.follow_duration_minutes == 1 else 's'})", value=f"`{event.target.follow_duration_minutes}`", inline=True)
         return embed
 
-    def followersoff(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def followersoff(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         return self.set_chatroom_attrs(mod_action, embed)
 
-    def raid(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def raid(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed = self.set_chatroom_attrs(mod_action, embed)
         embed.add_field(
-            name="Raided Channel", value=f"[{event[mod_action.name]['user_name']}](<https://www.twitch.tv/{event[mod_action.name]['user_login']}>)", inline=True)
+            name="Raided Channel", value=f"[{event.target.user_name}](<https://www.twitch.tv/{event.target.user_login}>)", inline=True)
         return embed
 
-    def unraid(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def unraid(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         return self.set_chatroom_attrs(mod_action, embed)
 
-    def timeout(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def timeout(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed = self.set_user_attrs(streamer, event, mod_action, embed)
-        if event[mod_action.name]["reason"] == "":
+        if not event.target.reason:
             embed.add_field(
                 name="Flag Reason", value=f"`None Provided`")
         else:
             embed.add_field(
-                name="Flag Reason", value=f"``{event[mod_action.name]['reason'].replace('`', '​`​')}``")
+                name="Flag Reason", value=f"``{event.target.reason.replace('`', '​`​')}``")
             
-        delta = datetime.fromisoformat(event[mod_action.name]["expires_at"]) - datetime.fromisoformat(metadata["message_timestamp"])
+        delta = datetime.fromisoformat(event.target.expires_at) - datetime.fromisoformat(metadata.message_timestamp)
         duration = round(delta.total_seconds())
+        from humanize import precisedelta # Only timeouts need it
         humanized_duration = precisedelta(delta, format="%0.0f")
 
         if humanized_duration != f"{duration} second{'' if duration == 1 else 's'}":
@@ -233,91 +265,92 @@ class Parser:
             name="Duration", value=f"{humanized_duration}{seconds_display}")
 
         #embed.add_field(name="\u200b", value="\u200b")
-        return embed
+        return self.set_offender_attrs(streamer, event, embed)
 
-    def untimeout(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def untimeout(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         return self.set_user_attrs(streamer, event, mod_action, embed)
 
-    def ban(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def ban(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed = self.set_user_attrs(streamer, event, mod_action, embed)
-        if event[mod_action.name]["reason"] == "":
+        if not event.target.reason:
             embed.add_field(
                 name="Flag Reason", value=f"`None Provided`")
         else:
             embed.add_field(
-                name="Flag Reason", value=f"``{event[mod_action.name]['reason'].replace('`', '​`​')}``")
-        return embed
+                name="Flag Reason", value=f"``{event.target.reason.replace('`', '​`​')}``")
+        return self.set_offender_attrs(streamer, event, embed)
 
-    def unban(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def unban(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed.colour = self.colour.green
         return self.set_user_attrs(streamer, event, mod_action, embed)
 
-    def delete(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def delete(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed = self.set_user_attrs(streamer, event, mod_action, embed)
         embed.add_field(
-            name="Message", value=f"``{event[mod_action.name]['message_body'].replace('`', '​`​')}``")
+            name="Message", value=f"``{event.target.message_body.replace('`', '​`​')}``")
 
         return embed
 
-    def mod(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def mod(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed = self.set_user_attrs(streamer, event, mod_action, embed)
         embed.title = "Moderator Added Action" #Use a custom title for adding/removing mods for looks
         embed.colour = self.colour.green
         return embed
 
-    def unmod(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def unmod(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed = self.set_user_attrs(streamer, event, mod_action, embed)
         embed.title = "Moderator Removed Action"
         return embed
 
-    def vip(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def vip(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed = self.set_user_attrs(streamer, event, mod_action, embed)
         if embed.title is not None:
             embed.title = embed.title.replace('Vip', 'VIP') #Capitalize VIP for the looks
         embed.colour = self.colour.green
         return embed
 
-    def unvip(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def unvip(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed = self.set_user_attrs(streamer, event, mod_action, embed)
         if embed.title is not None:
             embed.title = embed.title.replace('Unvip', 'UnVIP')
         return embed
     
-    def warn(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def warn(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed.colour = self.colour.yellow
         embed.add_field(
-            name="Moderator Reason", value=f"`{event[mod_action.name]['reason']}`", inline=False)
-        return self.set_user_attrs(streamer, event, mod_action, embed)
+            name="Moderator Reason", value=f"`{event.target.reason}`", inline=False)
+        embed = self.set_user_attrs(streamer, event, mod_action, embed)
+        return self.set_offender_attrs(streamer, event, embed)
     
-    def acknowledge_warning(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def acknowledge_warning(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed = self.set_user_attrs(streamer, event, mod_action, embed)
         embed.colour = self.colour.green
         embed.title = "User Acknowledged Warning Action"
         embed.remove_field(1)
         return embed
     
-    def shared_chat_ban(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def shared_chat_ban(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed = self.set_user_attrs(streamer, event, mod_action, embed)
-        if event[mod_action.name]["reason"] == "":
+        if not event.target.reason:
             embed.add_field(
                 name="Flag Reason", value=f"`None Provided`")
         else:
             embed.add_field(
-                name="Flag Reason", value=f"``{event[mod_action.name]['reason'].replace('`', '`​')}``")
+                name="Flag Reason", value=f"``{event.target.reason.replace('`', '`​')}``")
         return embed
     
-    def shared_chat_unban(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def shared_chat_unban(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed.colour = self.colour.green
         return self.set_user_attrs(streamer, event, mod_action, embed)
     
-    def shared_chat_timeout(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def shared_chat_timeout(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed = self.set_user_attrs(streamer, event, mod_action, embed)
-        if event[mod_action.name]["reason"] == "":
+        if not event.target.reason:
             embed.add_field(
                 name="Flag Reason", value=f"`None Provided`")
         else:
             embed.add_field(
-                name="Flag Reason", value=f"```{event[mod_action.name]['reason'].replace('`', '​`​')}```")
+                name="Flag Reason", value=f"```{event.target.reason.replace('`', '​`​')}```")
                 
         def round_seconds(obj: timedelta) -> int:
             if obj.microseconds >= 500_000:
@@ -325,83 +358,82 @@ class Parser:
                 return obj.seconds
             return obj.seconds
             
-        duration = round_seconds(datetime.fromisoformat(event[mod_action.name]["expires_at"]) - datetime.fromisoformat(metadata["message_timestamp"]))
+        duration = round_seconds(datetime.fromisoformat(event.target.expires_at) - datetime.fromisoformat(metadata.message_timestamp))
 
         embed.add_field(
             name="Duration", value=f"{duration} second{'' if duration == 1 else 's'}")       
         
         return embed
     
-    def shared_chat_untimeout(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def shared_chat_untimeout(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         return self.set_user_attrs(streamer, event, mod_action, embed)
     
-    def shared_chat_delete(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def shared_chat_delete(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed = self.set_user_attrs(streamer, event, mod_action, embed)
         embed.add_field(
-            name="Message", value=f"```{event[mod_action.name]['message_body'].replace('`', '​`​')}```")
+            name="Message", value=f"```{event.target.message_body.replace('`', '​`​')}```")
 
         return embed
 
-    def add_permitted_term(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def add_permitted_term(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed = self.set_terms_attrs(mod_action, embed)
         embed.colour = self.colour.green
         embed.add_field(
-            name="Added by", value=f"{event['moderator_user_login']}")
+            name="Added by", value=f"{event.moderator_user_login}")
         embed.add_field(
-            name="Term", value=f"``{event['automod_terms']['terms'][0].replace('`', '​`​')}``", inline=False)
+            name="Term", value=f"``{event.target.terms[0].replace('`', '​`​')}``", inline=False)
         embed.add_field(
-            name="From Automod", value=f"`{'Yes' if event['automod_terms']['from_automod'] else 'No'}`")
+            name="From Automod", value=f"`{'Yes' if event.target.from_automod else 'No'}`")
         
         embed.remove_field(1)
         return embed
 
-    def add_blocked_term(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def add_blocked_term(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         return self.add_permitted_term(streamer, event, metadata, mod_action, embed)
 
-    def remove_permitted_term(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def remove_permitted_term(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         embed = self.set_terms_attrs(mod_action, embed)
         embed.add_field(
-            name="Added by", value=f"{event['moderator_user_login']}")
+            name="Added by", value=f"{event.moderator_user_login}")
         embed.add_field(
-            name="Term", value=f"``{event['automod_terms']['terms'][0].replace('`', '​`​')}``", inline=False)
+            name="Term", value=f"``{event.target.terms[0].replace('`', '​`​')}``", inline=False)
         embed.remove_field(1)
         return embed
 
-    def remove_blocked_term(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
+    def remove_blocked_term(self, streamer: Streamer, event: ModerateEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> disnake.Embed:
         return self.remove_permitted_term(streamer, event, metadata, mod_action, embed)
 
-    def automod_caught_message(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> Tuple[bool, disnake.Embed]:
+    def automod_caught_message(self, streamer: Streamer, event: AutomodEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> Tuple[bool, disnake.Embed]:
         ignore_message = False
-        user = event["user_login"]
+        user = event.user_login
         user_escaped = user.replace('_', r'\_')
         embed.title = f"{mod_action.value.replace('_', ' ').title()}"
         embed.color = self.colour.red
         embed.add_field(
             name="Flagged Account", value=f"[{user_escaped}](<https://www.twitch.tv/popout/{streamer.username}/viewercard/{user_escaped}>)", inline=True)
         # Automod events
-        if event["automod"] != None:
+        if event.automod is not None:
             embed.add_field(
-                name="Content Classification", value=f"{event['automod']['category'].title()} level {event['automod']['level']}", inline=True)
+                name="Content Classification", value=f"{event.automod.category.title()} level {event.automod.level}", inline=True)
         
         # Blocked term events
-        elif event["blocked_term"] != None:
-            terms_list = set([event["message"]["text"][term["boundary"]["start_pos"]:term["boundary"]["end_pos"]+1] for term in event["blocked_term"]["terms_found"]])
+        elif event.blocked_term is not None:
+            terms_list = set([event.message.text[term.boundary.start_pos:term.boundary.end_pos+1] for term in event.blocked_term.terms_found])
             embed.add_field(
                 name=f"Relevant Blocked Term{'s' if len(terms_list) != 1 else ''}", value=f"{'  '.join(f'``{term.replace('`', '​`​')}``' for term in terms_list)}", inline=True)
 
         text_fragments = []
-        for fragment in event["message"]["fragments"]:
-            if fragment != {}:
-                if fragment.get("text", None) is not None:
-                    text_fragments.append(fragment.get("text", None))
+        for fragment in event.message.fragments:
+            if fragment.text is not None:
+                text_fragments.append(fragment.text)
 
         embed.add_field(name="Text fragments", value=f"""{'  '.join(f"``{f.strip(' ').replace('`', '​`​')}``" for f in text_fragments)}""")
         
-        if event.get("status") == "allowed":
+        if event.status == "allowed":
             if "automod_allowed_message" not in streamer.action_whitelist and streamer.action_whitelist != []:
                 ignore_message = True
             embed.colour = self.colour.green
-        elif event.get("status") == "denied":
+        elif event.status == "denied":
             if "automod_denied_message" not in streamer.action_whitelist and streamer.action_whitelist != []:
                 ignore_message = True
             embed.colour = self.colour.red
@@ -411,8 +443,8 @@ class Parser:
             embed.colour = self.colour.yellow
         return ignore_message, embed
     
-    def automod_allowed_message(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> Tuple[bool, disnake.Embed]:
+    def automod_allowed_message(self, streamer: Streamer, event: AutomodEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> Tuple[bool, disnake.Embed]:
         return self.automod_caught_message(streamer, event, metadata, mod_action, embed)
 
-    def automod_denied_message(self, streamer: Streamer, event: dict, metadata: dict, mod_action: ModAction, embed: disnake.Embed) -> Tuple[bool, disnake.Embed]:
+    def automod_denied_message(self, streamer: Streamer, event: AutomodEvent, metadata: Metadata, mod_action: ModAction, embed: disnake.Embed) -> Tuple[bool, disnake.Embed]:
         return self.automod_caught_message(streamer, event, metadata, mod_action, embed)
\ No newline at end of file
@@ -0,0 +1,59 @@
+from collections import Counter, deque
+from time import monotonic
+from typing import Dict, Optional
+
+
+class OffenderIndex:
+    # Remembers which channels each account was banned, timed out or warned in over the last `window` seconds,
+    # so a log entry can say the same account was just actioned elsewhere.
+    # Every action is appended to one deque in arrival order and counted per user and channel. Expired actions
+    # fall off the front of the deque, so recording and looking up are O(1) amortised however many users are
+    # tracked, and max_actions caps memory when a raid outpaces the window
+    def __init__(self, window: int = 3600, max_actions: int = 100000, annotate_at: int = 1, alert_at: int = 0):
+        self.window = window
+        self.max_actions = max_actions
+        self.annotate_at = annotate_at  # Other channels before a log entry mentions them, 0 to never
+        self.alert_at = alert_at  # Other channels before an alert is raised, 0 to never
+        self._actions: deque[tuple[float, str, str]] = deque()  # (time, user, channel), oldest first
+        self._users: Dict[str, Counter] = {}  # user -> channel -> actions within the window
+
+    @property
+    def window_text(self) -> str:
+        # "hour", "6 hours", "minute", "90 minutes" or "30 seconds", for "in the last ..."
+        for unit, seconds in (("hour", 3600), ("minute", 60), ("second", 1)):
+            if self.window % seconds == 0:
+                count = self.window // seconds
+                return unit if count == 1 else f"{count} {unit}s"
+
+    def __len__(self):
+        return len(self._users)
+
+    def _forget_oldest(self):
+        _, user, channel = self._actions.popleft()
+        channels = self._users[user]
+        channels[channel] -= 1
+        if channels[channel] <= 0:
+            del channels[channel]
+            if not channels:
+                del self._users[user]
+
+    def evict(self, now: Optional[float] = None):
+        cutoff = (monotonic() if now is None else now) - self.window
+        while self._actions and self._actions[0][0] < cutoff:
+            self._forget_oldest()
+
+    def record(self, user: str, channel: str, now: Optional[float] = None) -> tuple[list[str], bool]:
+        # Returns the other channels the user was actioned in within the window, in the order they were first seen,
+        # and whether this action is the one that took the user to alert_at. That only happens when a new
+        # channel is added, so each user alerts once per window however many more actions follow
+        now = monotonic() if now is None else now
+        self.evict(now)
+        user = user.lower()
+        channels = self._users.setdefault(user, Counter())
+        channels[channel] += 1
+        first_here = channels[channel] == 1
+        self._actions.append((now, user, channel))
+        if len(self._actions) > self.max_actions:
+            self._forget_oldest()
+        others = [c for c in self._users.get(user, ()) if c != channel]
+        return others, first_here and self.alert_at > 0 and len(others) == self.alert_at
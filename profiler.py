@@ -0,0 +1,153 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import nullcontext
+from datetime import datetime
+from time import perf_counter
+from typing import Optional
+
+_NULL_SPAN = nullcontext()
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "args", "start")
+
+    def __init__(self, profiler: "Profiler", name: str, args: dict):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, perf_counter(), **self.args)
+        return False
+
+
+class Profiler:
+    # Runtime toggled profiling for a bounded window. While active it collects
+    # - stack samples of the event loop thread, dumped as folded stacks (speedscope, flamegraph.pl)
+    # - timing spans for each stage of a notification and event loop lag, dumped as a Chrome trace (Perfetto, chrome://tracing)
+    # While inactive span() hands back a shared no-op context manager, so instrumented code pays one attribute check
+    def __init__(self, output_dir: str = "profiles", window: int = 60, sample_interval: float = 0.005, lag_interval: float = 0.25):
+        self.logging = logging.getLogger("Twitch Pubsub Logging")
+        self.output_dir = output_dir
+        self.window = window
+        self.sample_interval = sample_interval
+        self.lag_interval = lag_interval
+        self.active: bool = False
+
+        self._started_at: float = 0
+        self._events: list[dict] = []
+        self._samples: Counter = Counter()
+        self._max_lag: float = 0
+        self._sampler: Optional[threading.Thread] = None
+        self._stop_sampling = threading.Event()
+        self._lag_task: Optional[asyncio.Task] = None
+        self._stop_handle: Optional[asyncio.TimerHandle] = None
+
+    def span(self, name: str, **args):
+        if not self.active:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def record(self, name: str, start: float, end: float, **args):
+        if not self.active:
+            return
+        self._events.append({
+            "name": name,
+            "ph": "X",
+            "ts": (start - self._started_at) * 1_000_000,
+            "dur": (end - start) * 1_000_000,
+            "pid": os.getpid(),
+            "tid": 0,
+            "args": args
+        })
+
+    def toggle(self):
+        if self.active:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self):
+        if self.active:
+            return
+        loop = asyncio.get_running_loop()
+        self._started_at = perf_counter()
+        self._events = []
+        self._samples = Counter()
+        self._max_lag = 0
+        self.active = True
+
+        self._stop_sampling.clear()
+        self._sampler = threading.Thread(
+            target=self._sample, args=(threading.get_ident(),), name="profiler-sampler", daemon=True)
+        self._sampler.start()
+        self._lag_task = loop.create_task(self._monitor_lag())
+        self._stop_handle = loop.call_later(self.window, self.stop)
+        self.logging.warning(f"Profiling enabled for {self.window} seconds")
+
+    def stop(self):
+        if not self.active:
+            return
+        self.active = False
+        if self._stop_handle is not None:
+            self._stop_handle.cancel()
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+        self._stop_sampling.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+        events, samples = self._events, self._samples
+        self._events, self._samples = [], Counter()
+        self.logging.warning(f"Profiling disabled. {len(events)} spans, {sum(samples.values())} samples, max loop lag {self._max_lag*1000:.1f}ms")
+        # Write the dumps off the event loop
+        asyncio.get_running_loop().run_in_executor(None, self._dump, events, samples)
+
+    def _sample(self, thread_id: int):
+        while not self._stop_sampling.wait(self.sample_interval):
+            frame = sys._current_frames().get(thread_id, None)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self._samples[";".join(reversed(stack))] += 1
+
+    async def _monitor_lag(self):
+        while True:
+            start = perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            now = perf_counter()
+            lag = max(now - start - self.lag_interval, 0)
+            self._max_lag = max(self._max_lag, lag)
+            self._events.append({
+                "name": "loop lag",
+                "ph": "C",
+                "ts": (now - self._started_at) * 1_000_000,
+                "pid": os.getpid(),
+                "args": {"lag_ms": lag * 1000}
+            })
+
+    def _dump(self, events: list[dict], samples: Counter):
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+            trace_path = os.path.join(self.output_dir, f"trace-{stamp}.json")
+            with open(trace_path, "w") as f:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+            samples_path = os.path.join(self.output_dir, f"samples-{stamp}.folded")
+            with open(samples_path, "w") as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in samples.items())
+            self.logging.warning(f"Wrote profile dumps to {trace_path} and {samples_path}")
+        except OSError as e:
+            self.logging.error(f"Unable to write profile dumps: {e}")
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# Sends signed EventSub webhook requests to a locally running ingest server, for testing the webhook transport.
+# Usage: python3 send_test_webhook.py BROADCASTER_ID [URL]
+# Uses the secret, port and path from settings.json. Sends a callback verification, a ban notification,
+# the same notification again (should be dropped as a duplicate) and one with a bad signature (should get a 403)
+
+import json
+import sys
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import requests
+
+from webhookserver import sign
+
+with open("settings.json") as f:
+    webhook_config = json.load(f)["_config"].get("webhook", {})
+secret = webhook_config["secret"]
+broadcaster_id = sys.argv[1]
+url = sys.argv[2] if len(sys.argv) > 2 else f"http://127.0.0.1:{webhook_config.get('port', 8080)}{webhook_config.get('path', '/eventsub')}"
+
+subscription = {
+    "id": str(uuid4()),
+    "status": "enabled",
+    "type": "channel.moderate",
+    "version": "2",
+    "condition": {"broadcaster_user_id": broadcaster_id, "moderator_user_id": "0"},
+    "transport": {"method": "webhook", "callback": url},
+    "created_at": datetime.now(timezone.utc).isoformat(),
+    "cost": 0
+}
+
+
+def send(message_type: str, payload: dict, message_id: str = None, signature: str = None) -> requests.Response:
+    body = json.dumps(payload).encode()
+    message_id = message_id or str(uuid4())
+    timestamp = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    headers = {
+        "Content-Type": "application/json",
+        "Twitch-Eventsub-Message-Id": message_id,
+        "Twitch-Eventsub-Message-Timestamp": timestamp,
+        "Twitch-Eventsub-Message-Signature": signature or sign(secret, message_id, timestamp, body),
+        "Twitch-Eventsub-Message-Type": message_type,
+        "Twitch-Eventsub-Subscription-Type": subscription["type"],
+        "Twitch-Eventsub-Subscription-Version": subscription["version"]
+    }
+    r = requests.post(url, data=body, headers=headers)
+    print(f"{message_type} {message_id}: {r.status_code} {r.text}")
+    return r
+
+
+challenge = str(uuid4())
+r = send("webhook_callback_verification", {"challenge": challenge, "subscription": subscription})
+print("Challenge answered correctly" if r.text == challenge else "Challenge answered incorrectly!")
+
+notification = {
+    "subscription": subscription,
+    "event": {
+        "broadcaster_user_id": broadcaster_id,
+        "broadcaster_user_login": "test_broadcaster",
+        "broadcaster_user_name": "Test_Broadcaster",
+        "source_broadcaster_user_id": None,
+        "moderator_user_id": "0",
+        "moderator_user_login": "test_moderator",
+        "moderator_user_name": "Test_Moderator",
+        "action": "ban",
+        "ban": {"user_id": "1", "user_login": "test_user", "user_name": "Test_User", "reason": "Test webhook"}
+    }
+}
+message_id = str(uuid4())
+send("notification", notification, message_id=message_id)
+send("notification", notification, message_id=message_id)
+send("notification", notification, signature="sha256=0")
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import sys
+from time import perf_counter
+from typing import TYPE_CHECKING, Dict, Optional
+
+from aiohttp import ClientSession
+
+from automodtracker import AutomodTracker
+from profiler import Profiler
+
+if TYPE_CHECKING:
+    from message import Message
+
+OVERFLOW_POLICIES = ("block", "drop_oldest")
+
+
+class Sink:
+    # Somewhere parsed events get delivered to. Every sink has its own queue and writer task, so a slow or
+    # failing one never holds up the others. Events are written in batches of up to batch_size, waiting at most
+    # flush_interval for a batch to fill. A failed batch is retried with backoff, then dropped.
+    # When max_queue events are waiting, "block" makes intake wait for room and "drop_oldest" discards the oldest
+    def __init__(self, name: str, profiler: Optional[Profiler] = None, batch_size: int = 100, flush_interval: float = 1.0,
+                 max_queue: int = 10000, overflow: str = "drop_oldest", retries: int = 3):
+        self.logging = logging.getLogger("Twitch Pubsub Logging")
+        self.name = name
+        self.profiler = profiler or Profiler()
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.retries = retries
+        self.session: ClientSession = None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._batch: list = []  # Being written, kept so it can be saved if we're stopped mid-write
+        self._full = asyncio.Event()
+        self._draining = False
+
+    def __str__(self):
+        return self.name
+
+    async def put(self, message: "Message"):
+        if self.overflow == "drop_oldest" and self.queue.full():
+            self.queue.get_nowait()
+            self.queue.task_done()
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 100 == 0:
+                self.logging.warning(f"Sink {self.name} is falling behind, {self.dropped} event{'' if self.dropped == 1 else 's'} dropped so far")
+        await self.queue.put(message)
+        if self.queue.qsize() >= self.batch_size - 1:
+            self._full.set()
+
+    async def run(self):
+        while True:
+            batch = [await self.queue.get()]
+            if self.batch_size > 1 and self.flush_interval > 0 and not self._draining and self.queue.qsize() < self.batch_size - 1:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            self._batch = batch
+            now = perf_counter()
+            for message in batch:
+                self.profiler.record("queue wait", message.queued_at, now, message_id=message.message_id, sink=self.name)
+            with self.profiler.span("write", sink=self.name, count=len(batch)):
+                await self.write_with_retry(batch)
+            self._batch = []
+            for _ in batch:
+                self.queue.task_done()
+
+    async def write_with_retry(self, batch: list):
+        for attempt in range(self.retries + 1):
+            try:
+                await self.write(batch)
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    self.logging.error(f"Sink {self.name} failed to write {len(batch)} event{'' if len(batch) == 1 else 's'}, dropping them: {type(e).__name__}: {e}")
+                    return
+                delay = min(2 ** attempt, 30)
+                self.logging.warning(f"Sink {self.name} write failed ({type(e).__name__}: {e}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+
+    async def write(self, batch: list):
+        raise NotImplementedError
+
+    async def drain(self):
+        # Write whatever is queued without waiting for batches to fill
+        self._draining = True
+        self._full.set()
+        await self.queue.join()
+
+    def pending(self) -> list:
+        # Everything not yet written, for saving on shutdown. Only valid once the writer task has stopped
+        messages = list(self._batch)
+        while not self.queue.empty():
+            messages.append(self.queue.get_nowait())
+        return messages
+
+
+class DiscordSink(Sink):
+    # The streamer's Discord webhooks. Messages go out one at a time so automod holds can be edited once resolved
+    def __init__(self, name: str, tracker: AutomodTracker, **kwargs):
+        kwargs = {"batch_size": 1, "flush_interval": 0, "max_queue": 0, "overflow": "block", "retries": 0, **kwargs}
+        super().__init__(name, **kwargs)
+        self.tracker = tracker
+
+    async def put(self, message: "Message"):
+        # Tracked here rather than at parse time, the other sinks still get every resolution on its own
+        if self.tracker.track(message):
+            return # Automod resolution merged into its pending hold, that send covers it
+        await super().put(message)
+
+    async def write(self, batch: list):
+        for message in batch:
+            with self.profiler.span("send", message_id=message.message_id):
+                await message.send(session=self.session)
+
+    def pending(self) -> list:
+        messages = []
+        for message in super().pending():
+            messages.append(message)
+            resolution = self.tracker.absorbed(message)
+            if resolution is not None:  # Never queued on its own, so it has to be saved alongside its hold
+                messages.append(resolution)
+        return messages
+
+
+class JsonlSink(Sink):
+    # Appends one JSON object per event to a file, e.g. for a SIEM to pick up. The file is reopened for every
+    # batch, so it can be rotated underneath us
+    def __init__(self, name: str, path: str, **kwargs):
+        super().__init__(name, **kwargs)
+        self.path = path
+
+    def _append(self, data: bytes):
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    async def write(self, batch: list):
+        await asyncio.to_thread(self._append, b"".join(message.record_json + b"\n" for message in batch))
+
+
+class HttpSink(Sink):
+    # POSTs each batch as a JSON array
+    def __init__(self, name: str, url: str, headers: Optional[dict] = None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.url = url
+        self.headers = {"Content-Type": "application/json", **(headers or {})}
+
+    async def write(self, batch: list):
+        body = b"[" + b",".join(message.record_json for message in batch) + b"]"
+        async with self.session.post(self.url, data=body, headers=self.headers) as r:
+            r.raise_for_status()
+
+
+class StdoutSink(Sink):
+    # JSON lines on stdout, for log collectors that read the container output
+    def _write(self, data: bytes):
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+    async def write(self, batch: list):
+        await asyncio.to_thread(self._write, b"".join(message.record_json + b"\n" for message in batch))
+
+
+SINK_TYPES = {
+    "discord": DiscordSink,
+    "jsonl": JsonlSink,
+    "http": HttpSink,
+    "stdout": StdoutSink
+}
+
+
+def build_sinks(config: dict, tracker: AutomodTracker, profiler: Optional[Profiler] = None) -> Dict[str, Sink]:
+    # Builds the sinks from the _config.sinks section. Raises ValueError for anything that doesn't make sense.
+    # A Discord sink called "discord" always exists, configuring one with that name only changes its options.
+    # It's the only one allowed, a second would post everything to the same webhooks again and share its automod tracker
+    sinks: Dict[str, Sink] = {}
+    config = {"discord": {"type": "discord"}, **(config or {})}
+    for name, options in config.items():
+        options = dict(options)
+        sink_type = options.pop("type", None)
+        if sink_type not in SINK_TYPES:
+            raise ValueError(f"sink {name} has unknown type {sink_type}")
+        if sink_type == "discord" and name != "discord":
+            raise ValueError(f"sink {name} would be a second discord sink, options for the streamers' webhooks go on the sink called discord")
+        if name == "discord" and sink_type != "discord":
+            raise ValueError("sink discord is the streamers' webhooks and has to be of type discord")
+        kwargs = {"profiler": profiler}
+        try:
+            for key, option, cast in (("batch_size", "batch_size", int), ("flush_interval", "flush_interval_seconds", float),
+                                      ("max_queue", "max_queue", int), ("retries", "retries", int)):
+                if option in options:
+                    kwargs[key] = cast(options.pop(option))
+        except ValueError:
+            raise ValueError(f"sink {name} has a non-numeric batch_size, flush_interval_seconds, max_queue or retries")
+        if "overflow" in options:
+            kwargs["overflow"] = options.pop("overflow")
+            if kwargs["overflow"] not in OVERFLOW_POLICIES:
+                raise ValueError(f"sink {name} overflow must be one of {', '.join(OVERFLOW_POLICIES)}")
+
+        if sink_type == "discord":
+            sinks[name] = DiscordSink(name, tracker, **kwargs)
+        elif sink_type == "jsonl":
+            if not options.get("path", None):
+                raise ValueError(f"jsonl sink {name} needs a path")
+            sinks[name] = JsonlSink(name, options.pop("path"), **kwargs)
+        elif sink_type == "http":
+            if not options.get("url", None):
+                raise ValueError(f"http sink {name} needs a url")
+            sinks[name] = HttpSink(name, options.pop("url"), headers=options.pop("headers", None), **kwargs)
+        else:
+            sinks[name] = StdoutSink(name, **kwargs)
+        if options:
+            raise ValueError(f"sink {name} has unknown option{'' if len(options) == 1 else 's'} {', '.join(options)}")
+    return sinks
@@ -9,6 +9,7 @@ class Streamer:
     webhook_urls: List[str]
     enable_automod: bool = field(default=False)
     action_whitelist: List[str] = field(default_factory=list)
+    sinks: List[str] = field(default_factory=lambda: ["discord"])
 
     def __str__(self):
         return self.username
\ No newline at end of file
@@ -0,0 +1,21 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import bench_decode
+from automodtracker import AutomodState
+from tests.test_sinks import make_parser, parse
+
+
+def test_cleanup_expires_holds_that_never_finish():
+    parser = make_parser()
+    hold, = asyncio.run(parse(parser, bench_decode.AUTOMOD_FRAME))
+    tracker = parser.automod_tracker
+    tracker.track(hold)
+    entry = tracker.get(hold.automod_message_id)
+    entry.state = AutomodState.sending  # Stuck, as if its sender went away
+
+    hold._Message__created_at = datetime.utcnow() - timedelta(seconds=600)
+    assert tracker.cleanup(180) == 0  # Still within pending_max_age, the sender may finish it
+    hold._Message__created_at = datetime.utcnow() - timedelta(seconds=7200)
+    assert tracker.cleanup(180) == 1
+    assert len(tracker) == 0
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+import bench_decode
+from events import AutomodEvent, BanAction, ModerateEvent, SchemaError, decode_frame, decode_webhook
+
+
+def webhook_headers(message_type: str, subscription_type: str = "channel.moderate") -> dict:
+    return {
+        "Twitch-Eventsub-Message-Id": "abc",
+        "Twitch-Eventsub-Message-Type": message_type,
+        "Twitch-Eventsub-Message-Timestamp": "2024-11-20T18:40:12.634234626Z",
+        "Twitch-Eventsub-Subscription-Type": subscription_type,
+        "Twitch-Eventsub-Subscription-Version": "2"
+    }
+
+
+def test_decodes_typed_events():
+    frame = decode_frame(bench_decode.BAN_FRAME)
+    assert isinstance(frame.event, ModerateEvent) and isinstance(frame.event.target, BanAction)
+    assert (frame.event.target.user_login, frame.event.target.reason) == ("bad_user", "spam")
+    assert frame.raw["payload"]["event"]["ban"]["user_id"] == "4242"
+
+    start, end = frame.decode_span
+    assert 0 < start <= end
+
+    frame = decode_frame(bench_decode.AUTOMOD_FRAME.decode())
+    assert isinstance(frame.event, AutomodEvent)
+    assert frame.event.blocked_term.terms_found[0].boundary.end_pos == 12
+
+
+def test_webhook_payload_gets_the_same_raw_shape():
+    body = json.dumps(json.loads(bench_decode.BAN_FRAME)["payload"]).encode()
+    frame = decode_webhook(webhook_headers("notification"), body)
+    assert frame.event.target.user_login == "bad_user" and frame.decode_span[0] > 0
+    assert frame.raw["metadata"]["message_id"] == "abc" and frame.raw["payload"]["event"]["action"] == "ban"
+
+    challenge = json.dumps({"challenge": "xyz", "subscription": json.loads(body)["subscription"]}).encode()
+    frame = decode_webhook(webhook_headers("webhook_callback_verification"), challenge)
+    assert frame.event is None and frame.raw["payload"]["challenge"] == "xyz"
+
+
+@pytest.mark.parametrize("change, path", [
+    (lambda event: event["ban"].pop("user_login"), "payload.event.ban"),
+    (lambda event: event.__setitem__("ban", None), "payload.event.ban"),
+    (lambda event: event.__setitem__("moderator_user_id", 9001), "payload.event.moderator_user_id"),
+])
+def test_schema_errors_name_the_field_and_keep_the_frame(change, path):
+    frame = json.loads(bench_decode.BAN_FRAME)
+    change(frame["payload"]["event"])
+    with pytest.raises(SchemaError) as error:
+        decode_frame(json.dumps(frame))
+    assert error.value.path == path
+    assert error.value.raw == frame
+
+
+def test_invalid_json():
+    with pytest.raises(SchemaError) as error:
+        decode_frame(b'{"metadata": ')
+    assert error.value.path == "$" and error.value.raw is None
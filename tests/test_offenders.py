@@ -0,0 +1,15 @@
+import pytest
+
+from offenders import OffenderIndex
+
+
+@pytest.mark.parametrize("window, text", [
+    (3600, "hour"),
+    (6 * 3600, "6 hours"),
+    (60, "minute"),
+    (90 * 60, "90 minutes"),
+    (30, "30 seconds"),
+    (1, "second"),
+])
+def test_window_text(window, text):
+    assert OffenderIndex(window=window).window_text == text
@@ -0,0 +1,202 @@
+# Every sink type run against a local stand-in for where it delivers: a temporary file, an HTTP collector,
+# captured stdout, and a fake of the Discord webhook API
+import asyncio
+import json
+
+import pytest
+from aiohttp import ClientSession, web
+
+import bench_decode
+from events import decode_frame
+from messageparser import Parser
+from sinks import DiscordSink, HttpSink, JsonlSink, StdoutSink, build_sinks
+from streamer import Streamer
+
+WEBHOOK_PATH = "/api/webhooks/1/token"
+
+
+def automod_update(status: str) -> str:
+    frame = json.loads(bench_decode.AUTOMOD_FRAME)
+    frame["payload"]["subscription"]["type"] = "automod.message.update"
+    frame["payload"]["event"].update(status=status, moderator_user_name="Cool_Mod")
+    return json.dumps(frame)
+
+
+def make_parser(webhook_urls=()) -> Parser:
+    streamer = Streamer("cool_user", "Cool_User", "", list(webhook_urls), enable_automod=True)
+    return Parser({"1337": streamer}, use_embeds=False)
+
+
+async def parse(parser: Parser, *frames):
+    return [await parser.parse_message(decode_frame(frame)) for frame in frames]
+
+
+async def deliver(sink, messages, session=None):
+    sink.session = session
+    task = asyncio.create_task(sink.run())
+    for message in messages:
+        await sink.put(message)
+    await asyncio.wait_for(sink.drain(), 10)
+    task.cancel()
+
+
+async def serve(routes) -> tuple[web.AppRunner, str]:
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+
+def test_jsonl_sink_appends_a_line_per_event(tmp_path):
+    path = tmp_path / "events.jsonl"
+
+    async def run():
+        messages = await parse(make_parser(), bench_decode.BAN_FRAME, bench_decode.AUTOMOD_FRAME)
+        await deliver(JsonlSink("siem", str(path), batch_size=10, flush_interval=0.05), messages)
+
+    asyncio.run(run())
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [r["type"] for r in records] == ["channel.moderate", "automod.message.hold"]
+    assert records[0]["event"]["ban"]["user_login"] == "bad_user"
+
+
+def test_http_sink_posts_batches_and_retries_failures():
+    batches = []
+
+    async def ingest(request):
+        if not batches:
+            batches.append(None)  # First attempt fails, like a collector that's restarting
+            return web.Response(status=503)
+        assert request.headers["Authorization"] == "Bearer abc"
+        batches.append(await request.json())
+        return web.Response(status=200)
+
+    async def run():
+        runner, url = await serve([web.post("/ingest", ingest)])
+        try:
+            messages = await parse(make_parser(), bench_decode.BAN_FRAME, bench_decode.BAN_FRAME, bench_decode.AUTOMOD_FRAME)
+            async with ClientSession() as session:
+                sink = HttpSink("collector", f"{url}/ingest", headers={"Authorization": "Bearer abc"}, batch_size=2, flush_interval=0.05)
+                await deliver(sink, messages, session)
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+    assert batches[0] is None
+    assert [len(batch) for batch in batches[1:]] == [2, 1]
+    assert batches[-1][0]["type"] == "automod.message.hold"
+
+
+def test_stdout_sink_prints_json_lines(capfdbinary):
+    async def run():
+        messages = await parse(make_parser(), bench_decode.BAN_FRAME)
+        await deliver(StdoutSink("stdout", flush_interval=0), messages)
+
+    asyncio.run(run())
+    lines = capfdbinary.readouterr().out.splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])["action"] == "ban"
+
+
+def discord_routes(calls: list, on_post=None) -> list:
+    # Records ("POST", first line) and ("PATCH", message id, first line). on_post can take over a request
+    async def post(request):
+        content = (await request.json())["content"].splitlines()[1]
+        if on_post is not None:
+            response = on_post(request, content)
+            if response is not None:
+                return response
+        calls.append(("POST", content))
+        if request.query.get("wait") == "true":
+            return web.json_response({"id": str(len(calls))})
+        return web.Response(status=204)
+
+    async def patch(request):
+        calls.append(("PATCH", request.match_info["message_id"], (await request.json())["content"].splitlines()[1]))
+        return web.json_response({"id": request.match_info["message_id"]})
+
+    return [web.post(WEBHOOK_PATH, post), web.patch(WEBHOOK_PATH + "/messages/{message_id}", patch)]
+
+
+def run_discord(calls: list, batches, on_post=None, before=None) -> Parser:
+    # Delivers each batch of frames through a DiscordSink in turn, waiting for one to drain before the next.
+    # before is awaited with the parser first
+    parser = None
+
+    async def run():
+        nonlocal parser
+        runner, url = await serve(discord_routes(calls, on_post))
+        try:
+            parser = make_parser([url + WEBHOOK_PATH])
+            if before is not None:
+                await before(parser)
+            sink = DiscordSink("discord", parser.automod_tracker)
+            async with ClientSession() as session:
+                for frames in batches:
+                    await deliver(sink, await parse(parser, *frames), session)
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+    return parser
+
+
+def test_discord_sink_edits_holds_resolved_after_posting():
+    calls = []
+    parser = run_discord(calls, [[bench_decode.BAN_FRAME, bench_decode.AUTOMOD_FRAME], [automod_update("approved")]])
+    assert [call[0] for call in calls] == ["POST", "POST", "PATCH"]
+    assert "Mod Ban Action" in calls[0][1]
+    assert "Automod Caught Message" in calls[1][1]
+    assert calls[2][1] == "2" and "Automod Allowed Message" in calls[2][2]
+    assert len(parser.automod_tracker) == 0
+
+
+def test_discord_sink_posts_holds_resolved_while_queued_once():
+    calls = []
+    parser = run_discord(calls, [[bench_decode.AUTOMOD_FRAME, automod_update("denied")]])
+    assert calls == [("POST", calls[0][1])]
+    assert "Automod Denied Message" in calls[0][1]
+    assert len(parser.automod_tracker) == 0
+
+
+def test_discord_sink_posts_the_resolution_of_a_hold_that_failed_to_send():
+    calls = []
+    state = {}
+
+    def drop_hold(request, content):
+        if "Automod Caught Message" not in content:
+            return None
+        # Resolved while the hold is being posted, then the connection drops
+        assert state["parser"].automod_tracker.track(state["resolution"])
+        request.transport.close()
+        return web.Response(status=500)
+
+    async def before(parser):
+        state["parser"] = parser
+        state["resolution"], = await parse(parser, automod_update("approved"))
+
+    parser = run_discord(calls, [[bench_decode.AUTOMOD_FRAME]], drop_hold, before)
+    assert len(calls) == 1 and "Automod Allowed Message" in calls[0][1]
+    assert len(parser.automod_tracker) == 0
+
+
+def test_build_sinks_always_has_one_discord_sink():
+    tracker = make_parser().automod_tracker
+    sinks = build_sinks({"siem": {"type": "jsonl", "path": "events.jsonl"}}, tracker)
+    assert isinstance(sinks["discord"], DiscordSink) and isinstance(sinks["siem"], JsonlSink)
+    assert build_sinks({"discord": {"type": "discord", "retries": 2}}, tracker)["discord"].retries == 2
+
+
+@pytest.mark.parametrize("config", [
+    {"discord_copy": {"type": "discord"}},
+    {"discord": {"type": "stdout"}},
+    {"siem": {"type": "jsonl"}},
+    {"collector": {"type": "http", "url": "http://localhost", "verb": "PUT"}},
+    {"stdout": {"type": "stdout", "overflow": "sometimes"}},
+])
+def test_build_sinks_rejects_bad_config(config):
+    with pytest.raises(ValueError):
+        build_sinks(config, make_parser().automod_tracker)
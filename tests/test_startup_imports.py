@@ -0,0 +1,13 @@
+# Text mode is only fast to start if the Discord library and friends stay unimported, which nothing else would notice
+from bench_startup import DEFERRED, measure
+
+
+def test_text_mode_skips_heavy_imports():
+    _, loaded = measure(use_embeds=False, runs=1)
+    assert loaded == []
+
+
+def test_embed_mode_still_loads_disnake():
+    # Makes sure the check above can fail at all
+    _, loaded = measure(use_embeds=True, runs=1)
+    assert "disnake" in loaded and "disnake" in DEFERRED
@@ -0,0 +1,84 @@
+# TokenPool against a local stand-in for Twitch's OAuth endpoints
+import asyncio
+
+import pytest
+from aiohttp import ClientSession, web
+
+import tokenpool
+from tokenpool import Account, TokenPool
+
+
+class FakeTwitch:
+    def __init__(self):
+        self.validate_status = 200
+        self.token_status = 200
+        self.token_requests = []
+
+    async def validate(self, request):
+        if self.validate_status != 200 or request.headers["Authorization"] == "OAuth expired":
+            return web.Response(status=self.validate_status if self.validate_status != 200 else 401)
+        expires_in = 14400 if request.headers["Authorization"] == "OAuth fresh" else 3600
+        return web.json_response({"login": "cool_mod", "user_id": "1", "expires_in": expires_in})
+
+    async def token(self, request):
+        self.token_requests.append((dict(request.query), dict(await request.post())))
+        if self.token_status != 200:
+            return web.Response(status=self.token_status)
+        return web.json_response({"access_token": "fresh", "refresh_token": "r2", "expires_in": 14400})
+
+
+def run_pool(fake: FakeTwitch, tmp_path, test, token: str = "expired"):
+    async def run():
+        app = web.Application()
+        app.add_routes([web.get("/validate", fake.validate), web.post("/token", fake.token)])
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        auth_url, tokenpool.AUTH_URL = tokenpool.AUTH_URL, f"http://127.0.0.1:{runner.addresses[0][1]}"
+        account = Account("1", token, refresh_token="r")
+        pool = TokenPool("client", "secret", [account], store_path=str(tmp_path / "tokens.json"))
+        try:
+            async with ClientSession() as pool.session:
+                await test(pool, account)
+        finally:
+            tokenpool.AUTH_URL = auth_url
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def test_refresh_sends_the_secret_as_a_form(tmp_path):
+    fake = FakeTwitch()
+
+    async def test(pool, account):
+        assert await pool.validate(account)
+        assert account.auth_token == "fresh"
+
+    run_pool(fake, tmp_path, test)
+    query, form = fake.token_requests[0]
+    assert query == {}
+    assert form == {"client_id": "client", "client_secret": "secret", "grant_type": "refresh_token", "refresh_token": "r"}
+
+
+@pytest.mark.parametrize("validate_status, token_status, valid", [(503, 200, True), (429, 200, True), (200, 503, True), (200, 400, False)])
+def test_only_a_failed_refresh_invalidates(tmp_path, validate_status, token_status, valid):
+    fake = FakeTwitch()
+    fake.validate_status, fake.token_status = validate_status, token_status
+
+    async def test(pool, account):
+        await pool.validate_all()
+        assert account.valid == valid
+
+    run_pool(fake, tmp_path, test)
+
+
+def test_tokens_are_refreshed_before_they_expire(tmp_path):
+    fake = FakeTwitch()
+
+    async def test(pool, account):
+        await pool.validate_all()  # An hour left, under REFRESH_AHEAD
+        assert account.valid and account.auth_token == "fresh"
+        await pool.validate_all()  # Four hours left, nothing to do
+        assert len(fake.token_requests) == 1
+
+    run_pool(fake, tmp_path, test, token="old")
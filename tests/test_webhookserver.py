@@ -0,0 +1,81 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+
+from aiohttp import ClientSession
+
+import bench_decode
+from webhookserver import WebhookServer, sign
+
+SECRET = "s3cret-s3cret"
+BAN_PAYLOAD = json.dumps(json.loads(bench_decode.BAN_FRAME)["payload"]).encode()
+
+
+def signed_headers(message_id: str, body: bytes) -> dict:
+    timestamp = datetime.now(timezone.utc).isoformat()
+    return {
+        "Twitch-Eventsub-Message-Id": message_id,
+        "Twitch-Eventsub-Message-Type": "notification",
+        "Twitch-Eventsub-Message-Timestamp": timestamp,
+        "Twitch-Eventsub-Message-Signature": sign(SECRET, message_id, timestamp, body),
+        "Twitch-Eventsub-Subscription-Type": "channel.moderate",
+        "Twitch-Eventsub-Subscription-Version": "2"
+    }
+
+
+async def no_errors(e, json_message, raw_message):
+    raise AssertionError(f"unexpected {e!r}")
+
+
+def run_server(handler, test, on_error=no_errors):
+    async def run():
+        server = WebhookServer(SECRET, handler, on_error, host="127.0.0.1", port=0)
+        await server.start()
+        url = f"http://127.0.0.1:{server._runner.addresses[0][1]}/eventsub"
+        try:
+            async with ClientSession() as session:
+                async def post(message_id: str, body: bytes = BAN_PAYLOAD) -> int:
+                    async with session.post(url, data=body, headers=signed_headers(message_id, body)) as r:
+                        return r.status
+                await test(post)
+        finally:
+            await server.stop()
+    asyncio.run(run())
+
+
+def test_a_failed_delivery_is_accepted_again_on_retry():
+    frames = []
+
+    async def handler(frame):
+        if not frames:
+            frames.append(None)
+            raise RuntimeError("sink down")
+        frames.append(frame)
+
+    async def test(post):
+        assert await post("m1") == 500
+        assert await post("m1") == 204
+        assert await post("m1") == 204  # Delivered now, so this one is a duplicate
+    run_server(handler, test)
+    assert len(frames) == 2 and frames[1].event.target.user_login == "bad_user"
+
+
+def test_schema_errors_reach_the_exception_handler():
+    errors = []
+
+    async def handler(frame):
+        raise AssertionError("an invalid payload was handed off")
+
+    async def on_error(e, json_message, raw_message):
+        errors.append((e, json_message, raw_message))
+
+    payload = json.loads(BAN_PAYLOAD)
+    payload["event"]["ban"] = None
+    body = json.dumps(payload).encode()
+
+    async def test(post):
+        assert await post("m1", body) == 400
+    run_server(handler, test, on_error)
+    [(e, json_message, raw_message)] = errors
+    assert e.path == "event.ban" and raw_message == body
+    assert json_message["metadata"]["message_id"] == "m1" and json_message["payload"]["event"]["action"] == "ban"
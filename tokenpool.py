@@ -0,0 +1,184 @@
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from time import time
+from typing import Dict, Iterable, List, Optional
+
+from aiohttp import ClientSession
+
+API_URL = "https://api.twitch.tv/helix"
+AUTH_URL = "https://id.twitch.tv/oauth2"
+VALIDATE_INTERVAL = 3600  # Twitch requires tokens to be validated at least hourly
+REFRESH_AHEAD = 2 * VALIDATE_INTERVAL  # Tokens with less than this left are refreshed at validation, before they run out
+
+
+@dataclass
+class Account:
+    user_id: str
+    auth_token: str
+    refresh_token: Optional[str] = None
+    login: Optional[str] = None
+    expires_at: float = 0
+    valid: bool = True
+    channels: set = field(default_factory=set)  # Broadcaster IDs this account moderates
+    assigned: set = field(default_factory=set)  # Broadcaster IDs currently subscribed through this account
+
+    def __str__(self):
+        return self.login or self.user_id
+
+
+class TokenPool:
+    # Holds every moderator account, keeps their tokens valid and spreads channels across them.
+    # Refreshed tokens are written to the token store, since settings.json would still hold the old ones
+    def __init__(self, client_id: str, client_secret: Optional[str], accounts: List[Account], store_path: str = "tokens.json"):
+        self.logging = logging.getLogger("Twitch Pubsub Logging")
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.accounts = accounts
+        self.store_path = store_path
+        self.session: ClientSession = None
+        self._assignments: Dict[str, Account] = {}
+        self.load_store()
+
+    def load_store(self):
+        try:
+            with open(self.store_path) as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            self.logging.warning(f"Ignoring unreadable token store {self.store_path}")
+            return
+        for account in self.accounts:
+            if account.user_id in stored:
+                account.auth_token = stored[account.user_id]["auth_token"]
+                account.refresh_token = stored[account.user_id].get("refresh_token", account.refresh_token)
+
+    def save_store(self):
+        try:
+            with open(self.store_path, "w") as f:
+                json.dump({a.user_id: {"auth_token": a.auth_token, "refresh_token": a.refresh_token} for a in self.accounts}, f, indent=4)
+        except OSError as e:
+            self.logging.error(f"Unable to save refreshed tokens to {self.store_path}: {e}")
+
+    def headers(self, account: Account) -> dict:
+        return {
+            "Authorization": f"Bearer {account.auth_token}",
+            "Client-ID": self.client_id,
+        }
+
+    async def validate(self, account: Account, refreshed: bool = False) -> bool:
+        # Only a 401 says anything about the token. Anything else is Twitch having trouble, and raises so
+        # validate_all keeps the account's last known state instead of failing its channels over
+        r = await self.session.get(f"{AUTH_URL}/validate", headers={"Authorization": f"OAuth {account.auth_token}"})
+        if r.status != 401:
+            r.raise_for_status()
+            data = await r.json()
+            account.login = data.get("login", None)
+            account.expires_at = time() + data.get("expires_in", 0)
+            account.valid = True
+            if data.get("user_id", account.user_id) != account.user_id:
+                self.logging.error(f"Token configured for {account.user_id} belongs to {data.get('user_id')}")
+                account.valid = False
+            elif not refreshed and 0 < data.get("expires_in", 0) < REFRESH_AHEAD and await self.refresh(account):
+                # Renewed ahead of time, a reconnect after it ran out would fail to subscribe until the next validation
+                return await self.validate(account, refreshed=True)
+            return account.valid
+        if not refreshed and await self.refresh(account):
+            return await self.validate(account, refreshed=True)
+        self.logging.error(f"Token for {account} is no longer valid")
+        account.valid = False
+        return False
+
+    async def refresh(self, account: Account) -> bool:
+        if not account.refresh_token or not self.client_secret:
+            return False
+        # Sent as a form rather than in the URL, so a failed request never logs the secret or the refresh token
+        r = await self.session.post(f"{AUTH_URL}/token", data={
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "grant_type": "refresh_token",
+            "refresh_token": account.refresh_token
+        })
+        if r.status >= 500 or r.status == 429:
+            raise ConnectionError(f"Twitch answered {r.status} refreshing the token")  # Try again at the next validation
+        if r.status != 200:
+            self.logging.error(f"Unable to refresh token for {account}: {r.status}")
+            return False
+        data = await r.json()
+        account.auth_token = data["access_token"]
+        account.refresh_token = data.get("refresh_token", account.refresh_token)
+        self.logging.info(f"Refreshed token for {account}")
+        self.save_store()
+        return True
+
+    async def validate_all(self) -> List[Account]:
+        results = await asyncio.gather(*[self.validate(a) for a in self.accounts], return_exceptions=True)
+        for account, result in zip(self.accounts, results):
+            if isinstance(result, Exception):
+                self.logging.warning(f"Unable to validate token for {account}: {result}")  # Network trouble, keep the last known state
+        return [a for a in self.accounts if a.valid]
+
+    async def load_moderated_channels(self, broadcaster_ids: Iterable[str]):
+        # Needs the user:read:moderated_channels scope. Without it we assume the account moderates every channel
+        # and let revocations sort it out
+        broadcaster_ids = set(broadcaster_ids)
+        for account in self.accounts:
+            if not account.valid:
+                continue
+            channels = {account.user_id}
+            cursor = None
+            while True:
+                params = {"user_id": account.user_id, "first": 100}
+                if cursor:
+                    params["after"] = cursor
+                r = await self.session.get(f"{API_URL}/moderation/channels", headers=self.headers(account), params=params)
+                if r.status != 200:
+                    self.logging.warning(f"Unable to list moderated channels for {account} ({r.status}), assuming all channels")
+                    channels = set(broadcaster_ids)
+                    break
+                data = await r.json()
+                channels.update(c["broadcaster_id"] for c in data["data"])
+                cursor = data.get("pagination", {}).get("cursor", None)
+                if not cursor:
+                    break
+            account.channels = channels & broadcaster_ids
+
+    def _pick(self, broadcaster_id: str, exclude: Optional[Account] = None) -> Optional[Account]:
+        candidates = [a for a in self.accounts if a.valid and a is not exclude and broadcaster_id in a.channels]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda a: len(a.assigned))  # Least loaded, spreads subscriptions and rate limits
+
+    def assign(self, broadcaster_ids: Iterable[str]) -> Dict[str, Account]:
+        for account in self.accounts:
+            account.assigned.clear()
+        self._assignments = {}
+        # Channels only a few accounts can see go first, so they don't end up queued behind ones anybody could take
+        for broadcaster_id in sorted(broadcaster_ids, key=lambda b: sum(b in a.channels for a in self.accounts if a.valid)):
+            account = self._pick(broadcaster_id)
+            if account is None:
+                self.logging.error(f"No valid moderator account for channel {broadcaster_id}")
+                continue
+            account.assigned.add(broadcaster_id)
+            self._assignments[broadcaster_id] = account
+        return dict(self._assignments)
+
+    def account_for(self, broadcaster_id: str) -> Optional[Account]:
+        return self._assignments.get(broadcaster_id, None)
+
+    def failover(self, broadcaster_id: str) -> Optional[Account]:
+        # The current account lost access to this channel, move it to another one that still has it
+        current = self._assignments.pop(broadcaster_id, None)
+        if current is not None:
+            current.assigned.discard(broadcaster_id)
+            current.channels.discard(broadcaster_id)
+        account = self._pick(broadcaster_id, exclude=current)
+        if account is None:
+            self.logging.error(f"No other moderator account can take over channel {broadcaster_id}")
+            return None
+        account.assigned.add(broadcaster_id)
+        self._assignments[broadcaster_id] = account
+        self.logging.warning(f"Moved channel {broadcaster_id} from {current} to {account}")
+        return account
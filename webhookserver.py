@@ -0,0 +1,93 @@
+import hashlib
+import hmac
+import logging
+import socket
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from time import monotonic
+from typing import Awaitable, Callable, Optional, Union
+
+from aiohttp import web
+
+from events import Frame, SchemaError, decode_webhook
+
+MESSAGE_MAX_AGE = 600  # Twitch recommends rejecting anything older than 10 minutes, which also bounds how long ids are kept
+MAX_SEEN_IDS = 100_000
+
+
+def sign(secret: str, message_id: str, timestamp: str, body: bytes) -> str:
+    digest = hmac.new(secret.encode(), message_id.encode() + timestamp.encode() + body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+class WebhookServer:
+    # Ingest server for EventSub's webhook transport. Verifies every request's signature, answers
+    # callback verification challenges, drops redeliveries and hands notifications and revocations to the same handler as the websocket
+    def __init__(self, secret: str, handler: Callable[[Frame], Awaitable[None]],
+                 on_error: Callable[[Exception, Optional[dict], Union[str, bytes, dict]], Awaitable[None]],
+                 host: str = "0.0.0.0", port: int = 8080, path: str = "/eventsub"):
+        self.logging = logging.getLogger("Twitch Pubsub Logging")
+        self.secret = secret
+        self.handler = handler
+        self.on_error = on_error
+        self.host = host
+        self.port = port
+        self.path = path
+        self._seen: OrderedDict[str, float] = OrderedDict()
+        self._runner: web.AppRunner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        # reuse_port lets a new instance listen alongside the old one during a handoff, the old one stops listening once it's drained
+        await web.TCPSite(self._runner, self.host, self.port, reuse_port=hasattr(socket, "SO_REUSEPORT")).start()
+        self.logging.info(f"Listening for EventSub webhooks on {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def is_duplicate(self, message_id: str) -> bool:
+        now = monotonic()
+        while self._seen and (len(self._seen) > MAX_SEEN_IDS or next(iter(self._seen.values())) < now - MESSAGE_MAX_AGE):
+            self._seen.popitem(last=False)
+        return message_id in self._seen
+
+    def remember(self, message_id: str):
+        # Only once a message was handed off, anything that failed before that has to be accepted again when Twitch retries it
+        self._seen[message_id] = monotonic()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        message_id = request.headers.get("Twitch-Eventsub-Message-Id", "")
+        timestamp = request.headers.get("Twitch-Eventsub-Message-Timestamp", "")
+        signature = request.headers.get("Twitch-Eventsub-Message-Signature", "")
+        if not hmac.compare_digest(sign(self.secret, message_id, timestamp, body), signature):
+            self.logging.warning(f"Rejected webhook with invalid signature from {request.remote}")
+            return web.Response(status=403)
+        try:
+            if datetime.now(timezone.utc) - datetime.fromisoformat(timestamp) > timedelta(seconds=MESSAGE_MAX_AGE):
+                self.logging.warning(f"Rejected stale webhook {message_id} sent at {timestamp}")
+                return web.Response(status=403)
+        except ValueError:
+            return web.Response(status=400)
+
+        if self.is_duplicate(message_id):  # Twitch retries anything it isn't sure was delivered
+            self.logging.debug(f"Ignoring duplicate webhook {message_id}")
+            return web.Response(status=204)
+
+        try:
+            frame = decode_webhook(request.headers, body)
+        except SchemaError as e:
+            self.logging.error(f"Invalid webhook payload: {e}")
+            await self.on_error(e, e.raw, body)
+            return web.Response(status=400)
+
+        if frame.metadata.message_type == "webhook_callback_verification":
+            self.logging.info(f"Verified webhook callback for {frame.subscription.type} subscription {frame.subscription.id}")
+            return web.Response(text=frame.raw["payload"]["challenge"], content_type="text/plain")
+        await self.handler(frame)
+        self.remember(message_id)
+        return web.Response(status=204)
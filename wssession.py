@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from time import time
+from typing import Awaitable, Callable, Optional, Union
+
+import websockets
+from websockets.legacy.client import WebSocketClientProtocol
+
+from events import Frame, decode_frame
+
+DEFAULT_CONNECTION_URL = "wss://eventsub.wss.twitch.tv/ws"
+CLOSE_TIMEOUT = 2
+
+
+class EventSubSession:
+    # One EventSub websocket connection. Session messages (welcome, reconnect, keepalive) are handled here,
+    # everything else goes to the shared frame handler. Each moderator account or conduit shard gets its own
+    def __init__(self, name: str, on_welcome: Callable[[str], Awaitable[None]], on_frame: Callable[[Frame], Awaitable[None]],
+                 on_error: Callable[[Exception, Optional[dict], Union[str, bytes, dict]], Awaitable[None]]):
+        self.logging = logging.getLogger("Twitch Pubsub Logging")
+        self.name = name
+        self.on_welcome = on_welcome
+        self.on_frame = on_frame
+        self.on_error = on_error
+
+        self.connection_url: str = DEFAULT_CONNECTION_URL
+        self.last_message_time: float = 0
+        self.should_resubscribe: bool = True
+        self.session_id: Optional[str] = None
+        self.connection: Optional[WebSocketClientProtocol] = None
+        self._tasks: list[asyncio.Task] = []
+        self._runner: Optional[asyncio.Task] = None
+        self.ready = asyncio.Event()  # Set once the first welcome has been handled, i.e. subscriptions are live
+
+    def start(self) -> asyncio.Task:
+        self._runner = asyncio.get_running_loop().create_task(self.run())
+        return self._runner
+
+    async def run(self):
+        while True:
+            self.logging.debug(f"Connecting to websocket for {self.name}")
+            # Twitch doesn't wait for the closing handshake, so there's no point giving it the default 10 seconds
+            async for connection in websockets.connect(self.connection_url, close_timeout=CLOSE_TIMEOUT):
+                self.connection = connection
+                self.logging.info(f"Connected to websocket for {self.name}")
+                if self.connection_url != DEFAULT_CONNECTION_URL:
+                    self.connection_url = DEFAULT_CONNECTION_URL
+                self._tasks = [
+                    asyncio.create_task(self.twitch_heartbeat(connection)), # Twitch requires we notice dead connections ourselves
+                    asyncio.create_task(self.message_reciever(connection)) # Recieves the messages from the websocket and parses them
+                ]
+                await asyncio.wait(self._tasks) # Tasks will run until the connection closes, we need to re-establish it if it closes
+                self.session_id = None
+
+    async def close(self):
+        if self._runner is not None:
+            self._runner.cancel() # Otherwise it just reconnects
+        # May be called from our own receiver when a revocation empties this account, it stops once the connection is closed
+        [task.cancel() for task in self._tasks if task is not asyncio.tasks.current_task()]
+        if self.connection is not None:
+            await self.connection.close()
+
+    async def message_reciever(self, connection: WebSocketClientProtocol):
+        while not connection.closed:
+            try:
+                message = await connection.recv()
+                self.last_message_time = time()
+                if type(message) == str or type(message) == bytes: # Both are decoded straight from the buffer
+                    await self.messagehandler(message)
+                else:
+                    self.logging.error(f"Received invalid type {type(message)} from websocket")
+            except websockets.exceptions.ConnectionClosed:
+                self.logging.warning(f"Connection with server closed for {self.name}")
+                [task.cancel() for task in self._tasks if task is not asyncio.tasks.current_task()]
+
+    async def twitch_heartbeat(self, connection: WebSocketClientProtocol):
+        while not connection.closed:
+            await asyncio.sleep(30)
+            if self.last_message_time + 30 < time() and not connection.closed:
+                self.logging.info(f"Connection for {self.name} seems dead, restarting websocket")
+                await connection.close()
+                [task.cancel() for task in self._tasks if task is not asyncio.tasks.current_task()]
+
+    async def messagehandler(self, raw_message: Union[str, bytes]):
+        try:
+            frame = decode_frame(raw_message)
+        except Exception as e:
+            await self.on_error(e, getattr(e, "raw", None), raw_message)
+            return
+        try:
+            metadata = frame.metadata
+            if metadata.message_type == "session_welcome":
+                self.logging.debug(f"Welcome message received for {self.name}")
+                self.session_id = frame.session.id
+                if self.should_resubscribe:
+                    await self.on_welcome(self.session_id)
+                self.should_resubscribe = True
+                self.ready.set()
+
+            # Twitch sends this message when it wants the client to reconnect, so we force disconnect and reconnect with the provided url
+            elif metadata.message_type == "session_reconnect":
+                self.logging.warning(f"Twitch requested reconnection for {self.name}")
+                self.connection_url = frame.session.reconnect_url
+                self.should_resubscribe = False
+                # Close the connection and let the code reconnect automatically
+                await self.connection.close()
+                [task.cancel() for task in self._tasks]
+
+            elif metadata.message_type == "session_keepalive":
+                return
+
+            else:
+                await self.on_frame(frame)
+
+        except Exception as e:
+            await self.on_error(e, frame.raw, frame.raw)